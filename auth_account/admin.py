@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import Group
-from .models import CustomUser, ProfilePicture, StudentProfile, TeacherProfile
+from .models import CustomUser, ImageJob, MediaBlob, OutboundEmail, ProfilePicture, StudentProfile, TeacherProfile
 
 class CustomUserAdmin(BaseUserAdmin):
     list_display = ["id", "email", "first_name", "last_name", "is_admin"]
@@ -71,9 +71,28 @@ class TeacherProfileAdmin(admin.ModelAdmin):
         return obj.user.last_name
     user_last_name.short_description = "Last Name"
 
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ["id", "to_email", "subject", "status", "attempts", "next_attempt_at", "sent_at"]
+    list_filter = ["status"]
+    list_per_page = 10
+    search_fields = ["to_email"]
+
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "picture", "status", "attempts", "next_attempt_at", "finished_at"]
+    list_filter = ["status"]
+    list_per_page = 10
+
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ["id", "name", "size", "references", "created_at"]
+    list_per_page = 10
+    search_fields = ["name"]
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(ProfilePicture, ProfilePictureAdmin)
 admin.site.register(StudentProfile, StudentProfileAdmin)
 admin.site.register(TeacherProfile, TeacherProfileAdmin)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+admin.site.register(ImageJob, ImageJobAdmin)
+admin.site.register(MediaBlob, MediaBlobAdmin)
 
 admin.site.unregister(Group)
@@ -0,0 +1,135 @@
+import threading
+import time
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_to_epoch, get_md5_hash_password
+from core.routers import check_user_pin, use_primary
+from .cache import user_cache
+
+
+class TokenRevocationList:
+    """
+    In-process record of revoked access tokens. Single tokens are revoked by
+    jti (on logout) until they would have expired anyway, and users are revoked
+    as a whole by remembering the moment before which their tokens are
+    rejected. A user's entry is dropped once every token issued before it has
+    expired. Lookups are plain dict reads, so checking costs no I/O.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._users = {}
+
+    def revoke_token(self, token):
+        with self._lock:
+            self._purge()
+            self._tokens[token[api_settings.JTI_CLAIM]] = token["exp"]
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            self._purge()
+            self._users[str(user_id)] = time.time()
+
+    def is_revoked(self, token):
+        if token.get(api_settings.JTI_CLAIM) in self._tokens:
+            return True
+        revoked_at = self._users.get(str(token.get(api_settings.USER_ID_CLAIM)))
+        return revoked_at is not None and token.get("iat", 0) < revoked_at
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def _purge(self):
+        now = time.time()
+        for jti in [jti for jti, exp in self._tokens.items() if exp <= now]:
+            del self._tokens[jti]
+        oldest = now - api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+        for user_id in [user_id for user_id, revoked_at in self._users.items() if revoked_at <= oldest]:
+            del self._users[user_id]
+
+
+token_revocations = TokenRevocationList()
+
+
+class SubsecondIatMixin:
+    """
+    Writes "iat" with microseconds instead of whole seconds, so a token issued
+    right after a `revoke_user` in the same second is told apart from the ones
+    it revoked.
+    """
+
+    def set_iat(self, claim="iat", at_time=None):
+        at_time = at_time or self.current_time
+        self.payload[claim] = datetime_to_epoch(at_time) + at_time.microsecond / 1_000_000
+
+
+class AccessToken(SubsecondIatMixin, tokens.AccessToken):
+    pass
+
+
+class RefreshToken(SubsecondIatMixin, tokens.RefreshToken):
+    access_token_class = AccessToken
+
+
+class RevocationCheckMixin:
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if token_revocations.is_revoked(validated_token):
+            raise InvalidToken(_("Token has been revoked"))
+        return validated_token
+
+
+class ReadYourWritesMixin:
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            check_user_pin(result[0].pk)
+        return result
+
+
+class StatelessJWTAuthentication(RevocationCheckMixin, JWTStatelessUserAuthentication):
+    """
+    Verifies the token's signature and expiry and checks it against
+    `token_revocations` without touching the database. The request user is a
+    simplejwt TokenUser built from the claims. Used where only "is this token
+    valid" matters.
+    """
+
+
+class CachedJWTAuthentication(ReadYourWritesMixin, RevocationCheckMixin, JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user through the in-process
+    `user_cache` instead of querying CustomUser on every request. The active and
+    password-revocation checks still run against the cached user. Misses load
+    from the primary: a lagging replica could hand back a row older than the
+    cache version it is stored under.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get(user_id)
+        if user is None:
+            version = user_cache.version(user_id)
+            with use_primary():
+                user = super().get_user(validated_token)
+            user_cache.set(user_id, version, user)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
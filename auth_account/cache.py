@@ -0,0 +1,361 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import timedelta
+import uuid
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework import status
+from rest_framework.response import Response
+from core.routers import use_primary
+
+"""
+Read View Caching
+
+Expensive read views cache their whole payload through CoalescedCacheMixin.
+Entries are stored with a freshness deadline and kept for a further
+`stale_timeout` seconds after it: a stale entry is still served to everyone
+while a single request rebuilds it (stale-while-revalidate), and when there is
+no entry at all concurrent requests for the same key are coalesced so only one
+of them runs the query and the others wait for and share its result.
+Coalescing is per process; each worker rebuilds a cold key at most once.
+"""
+
+HIT = "HIT"
+STALE = "STALE"
+MISS = "MISS"
+COALESCED = "COALESCED"
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call
+    for their key is running block until it finishes and get the same result
+    (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        """Returns `(result, shared)` where `shared` is True for waiters."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+single_flight = SingleFlight()
+
+
+def representation_key(request):
+    """
+    The URL plus the media type DRF negotiated for it, so the JSON and the
+    browsable API renderings of a URL never share a cache entry or an ETag.
+    """
+    media_type = getattr(request, "accepted_media_type", None) or request.META.get("HTTP_ACCEPT", "")
+    return f"{media_type}:{request.build_absolute_uri()}"
+
+
+class CoalescedCacheMixin:
+    """
+    Serves GET from the cache with request coalescing. Views implement
+    `build_data(request)`, which returns the payload to cache, and may override
+    `get_cache_key(request)`. The response carries an `X-Cache` header with
+    HIT, STALE, MISS or COALESCED, and the same outcomes are counted under
+    `cache_stats_prefix`.
+    """
+
+    cache_alias = "default"
+    cache_timeout = 300
+    stale_timeout = 60
+    cache_stats_prefix = None
+
+    def get_cache(self):
+        return caches[self.cache_alias]
+
+    def build_on_primary(self, request):
+        """Whether a miss must be rebuilt from the primary rather than a read replica."""
+        return False
+
+    def get_cache_key(self, request):
+        digest = hashlib.md5(representation_key(request).encode("utf-8")).hexdigest()
+        return f"{self.__class__.__name__}:{digest}"
+
+    def get_cached_data(self, request):
+        cache = self.get_cache()
+        key = self.get_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            if entry["fresh_until"] > time.time():
+                return entry["data"], HIT
+            if single_flight.in_flight(key):
+                return entry["data"], STALE
+
+        def build():
+            with use_primary() if self.build_on_primary(request) else nullcontext():
+                data = self.build_data(request)
+            cache.set(
+                key,
+                {"data": data, "fresh_until": time.time() + self.cache_timeout},
+                timeout=self.cache_timeout + self.stale_timeout,
+            )
+            return data
+
+        data, shared = single_flight.do(key, build)
+        return data, COALESCED if shared else MISS
+
+    def get(self, request, format=None):
+        data, outcome = self.get_cached_data(request)
+        if self.cache_stats_prefix:
+            _incr(self.get_cache(), f"{self.cache_stats_prefix}:{outcome.lower()}")
+        response = Response(data, status=status.HTTP_200_OK)
+        response["X-Cache"] = outcome
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+
+"""
+Directory Response Cache
+
+The public directory payloads change rarely, so whole pages are cached per URL.
+Keys are namespaced by a version stamp that the model signals replace on every
+save/delete, which invalidates every cached page at once without having to know
+which keys exist. The same stamp backs the strong ETag and Last-Modified
+headers, so a conditional GET for an unchanged page is answered with 304 from
+the cache alone. The default cache is local memory; point DIRECTORY_CACHE_ALIAS
+at a file based or shared cache when running several worker processes so
+invalidations are seen by all of them.
+"""
+
+VERSION_KEY = "directory:version"
+DIRECTORY_STATS_PREFIX = "directory:stats"
+DIRECTORY_MODELS = ["auth_account.CustomUser", "auth_account.TeacherProfile", "auth_account.ProfilePicture"]
+
+
+def get_directory_cache():
+    return caches[getattr(settings, "DIRECTORY_CACHE_ALIAS", "default")]
+
+
+def compute_directory_version():
+    """
+    Seeds the version stamp from the newest `updated_at` (an index lookup) and
+    the row count of every directory model. Only runs when the cache has no
+    stamp yet; afterwards the signals keep it current without touching the
+    database.
+    """
+    parts = []
+    last_modified = None
+    for label in DIRECTORY_MODELS:
+        stats = apps.get_model(label).objects.aggregate(latest=Max("updated_at"), rows=Count("pk"))
+        parts.append(f"{label}:{stats['latest']}:{stats['rows']}")
+        if stats["latest"] and (last_modified is None or stats["latest"] > last_modified):
+            last_modified = stats["latest"]
+    stamp = hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()
+    return {"stamp": stamp, "last_modified": last_modified or timezone.now()}
+
+
+def get_directory_version():
+    cache = get_directory_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = compute_directory_version()
+        cache.add(VERSION_KEY, version, timeout=None)
+        version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def invalidate_directory_cache(last_modified=None):
+    get_directory_cache().set(
+        VERSION_KEY,
+        {"stamp": uuid.uuid4().hex, "last_modified": last_modified or timezone.now()},
+        timeout=None,
+    )
+
+
+def get_directory_cache_stats():
+    cache = get_directory_cache()
+    stats = {
+        outcome.lower(): cache.get(f"{DIRECTORY_STATS_PREFIX}:{outcome.lower()}", 0)
+        for outcome in (HIT, STALE, MISS, COALESCED)
+    }
+    served = stats["hit"] + stats["stale"]
+    total = served + stats["miss"] + stats["coalesced"]
+    version = get_directory_version()
+    return {
+        "hits": stats["hit"],
+        "stale_hits": stats["stale"],
+        "misses": stats["miss"],
+        "coalesced": stats["coalesced"],
+        "hit_ratio": round(served / total, 4) if total else 0.0,
+        "version": version["stamp"],
+        "last_modified": version["last_modified"],
+    }
+
+
+def directory_etag(request, *args, **kwargs):
+    key = representation_key(request)
+    return hashlib.md5(f"{get_directory_version()['stamp']}:{key}".encode("utf-8")).hexdigest()
+
+
+def directory_last_modified(request, *args, **kwargs):
+    return get_directory_version()["last_modified"]
+
+
+class DirectoryCacheMixin(CoalescedCacheMixin):
+    cache_alias = getattr(settings, "DIRECTORY_CACHE_ALIAS", "default")
+    cache_timeout = getattr(settings, "DIRECTORY_CACHE_TIMEOUT", 300)
+    stale_timeout = getattr(settings, "DIRECTORY_CACHE_STALE_TIMEOUT", 60)
+    cache_stats_prefix = DIRECTORY_STATS_PREFIX
+
+    def get_cache_key(self, request):
+        key = super().get_cache_key(request)
+        return f"directory:{get_directory_version()['stamp']}:{key}"
+
+    def build_on_primary(self, request):
+        # A replica may not have the write that bumped the version yet, and a
+        # page built from it would stay cached until the next write.
+        pin = timedelta(seconds=getattr(settings, "DATABASE_PIN_SECONDS", 5))
+        return timezone.now() - get_directory_version()["last_modified"] < pin
+
+    @method_decorator(condition(etag_func=directory_etag, last_modified_func=directory_last_modified))
+    def get(self, request, format=None):
+        return super().get(request, format)
+
+
+"""
+Authenticated User Cache
+
+JWT authentication resolves the token's user id to a CustomUser on every
+request. UserCache keeps recently resolved users in a bounded, per-process LRU
+with a TTL. Each user id has a version that the CustomUser signals bump on save
+and delete (which covers password changes), and entries are keyed by id and
+version, so a lookup that raced with a save can never repopulate the cache with
+the old row. Versions come from one counter and are kept in an LRU of the same
+size; evicting one raises the version of every untracked user to the current
+counter, so no id can fall back to a version an in-flight lookup still holds.
+The signals bump versions after commit. Other worker processes only see a change once their entry's TTL
+has passed, so keep AUTH_USER_CACHE_TTL short.
+"""
+
+
+class UserCache:
+    """Users are keyed by the string form of their id, as it appears in tokens."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+
+    def _version(self, user_id):
+        return self._versions.get(user_id, self._floor)
+
+    def version(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            return self._version(user_id)
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            key = (user_id, self._version(user_id))
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.copy(user)
+
+    def set(self, user_id, version, user):
+        user_id = str(user_id)
+        if self.maxsize <= 0:
+            return
+        user = copy.copy(user)
+        user._state.fields_cache = {}
+        with self._lock:
+            if self._version(user_id) != version:
+                return
+            key = (user_id, version)
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._entries.pop((user_id, self._version(user_id)), None)
+            self._counter += 1
+            self._versions[user_id] = self._counter
+            self._versions.move_to_end(user_id)
+            while len(self._versions) > self.maxsize:
+                self._versions.popitem(last=False)
+                self._floor = self._counter
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_cache = UserCache(
+    maxsize=getattr(settings, "AUTH_USER_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "AUTH_USER_CACHE_TTL", 60),
+)
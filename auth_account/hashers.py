@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.encoding import force_bytes
+
+"""
+Pooled Password Hashing
+
+PBKDF2 is pure CPU work and dominates login and signup latency. The hasher below
+produces exactly the same `pbkdf2_sha256$...` strings as Django's default one,
+but runs the key derivation, for hashing and for verifying, in a bounded pool
+of PASSWORD_HASHING_WORKERS processes so a burst of logins cannot take every
+core away from the rest of the server. At most PASSWORD_HASHING_MAX_PENDING
+derivations are queued at once; further callers wait for a slot. With
+PASSWORD_HASHING_WORKERS = 0 (the default) hashing runs inline.
+"""
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = None
+
+
+def get_hashing_pool():
+    global _pool, _pending
+    workers = getattr(settings, "PASSWORD_HASHING_WORKERS", 0)
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Workers only ever run hashlib, so spawn them clean instead of
+            # forking a threaded server process.
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            max_pending = getattr(settings, "PASSWORD_HASHING_MAX_PENDING", 0) or workers * 4
+            _pending = threading.BoundedSemaphore(max_pending)
+        return _pool
+
+
+def shutdown_hashing_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def submit_pbkdf2(digest_name, password, salt, iterations):
+    """Returns a Future for `hashlib.pbkdf2_hmac(...)`, computed in the pool if there is one."""
+    pool = get_hashing_pool()
+    if pool is None:
+        future = Future()
+        future.set_result(hashlib.pbkdf2_hmac(digest_name, password, salt, iterations))
+        return future
+    pending = _pending
+    pending.acquire()
+    try:
+        future = pool.submit(hashlib.pbkdf2_hmac, digest_name, password, salt, iterations)
+    except BaseException:
+        pending.release()
+        raise
+    future.add_done_callback(lambda _: pending.release())
+    return future
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 hasher with the derivation done in the hashing pool."""
+
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = submit_pbkdf2(self.digest().name, force_bytes(password), force_bytes(salt), iterations).result()
+        hash = base64.b64encode(hash).decode("ascii").strip()
+        return "%s$%d$%s$%s" % (self.algorithm, iterations, salt, hash)
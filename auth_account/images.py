@@ -0,0 +1,296 @@
+import os
+import time
+import uuid
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import ChunkedUpload, ImageJob, ProfilePicture, release_picture_files
+
+"""
+Profile Picture Variants
+
+Avatars are shown at a handful of fixed sizes, so every upload is rendered once
+into square crops at PROFILE_PICTURE_VARIANT_SIZES in each of
+PROFILE_PICTURE_VARIANT_FORMATS and stored next to the original. The stored
+names are kept on the picture as {"<size>": {"<format>": name}}.
+
+Uploads are stored as-is and processed off the request path: `replace_picture`
+stores the upload as the picture, marks it processing and queues an ImageJob,
+and the `process_image_jobs` worker strips metadata from the original,
+re-encodes it, renders the variants and marks the picture ready.
+"""
+
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 6}),
+    "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# Formats an original is kept in; anything else is re-encoded as PNG.
+ORIGINAL_FORMATS = {
+    "JPEG": ("jpg", {"quality": 90, "optimize": True}),
+    "PNG": ("png", {"optimize": True}),
+    "WEBP": ("webp", {"quality": 90}),
+}
+
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "icc_profile")
+
+
+def get_variant_sizes():
+    return getattr(settings, "PROFILE_PICTURE_VARIANT_SIZES", [64, 128, 512])
+
+
+def get_variant_formats():
+    return getattr(settings, "PROFILE_PICTURE_VARIANT_FORMATS", ["webp", "jpeg"])
+
+
+def render_variants(image_file):
+    """
+    Yields `(size, format, bytes)` for every variant of the given image file.
+    EXIF orientation is applied and the image flattened to RGB first.
+    """
+    with Image.open(image_file) as source:
+        source.load()
+        image = ImageOps.exif_transpose(source)
+    if image.mode != "RGB":
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = background
+
+    for size in get_variant_sizes():
+        variant = ImageOps.fit(image, (size, size), method=Image.Resampling.LANCZOS)
+        for extension in get_variant_formats():
+            pil_format, options = FORMATS[extension]
+            buffer = BytesIO()
+            variant.save(buffer, pil_format, **options)
+            yield size, extension, buffer.getvalue()
+
+
+def render_original(image_file):
+    """
+    Returns `(extension, bytes)` for the upload re-encoded with EXIF orientation
+    applied and EXIF, XMP, comments and colour profiles dropped.
+    """
+    with Image.open(image_file) as source:
+        source.load()
+        pil_format = source.format if source.format in ORIGINAL_FORMATS else "PNG"
+        image = ImageOps.exif_transpose(source)
+    for key in METADATA_KEYS:
+        image.info.pop(key, None)
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    extension, options = ORIGINAL_FORMATS[pil_format]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return extension, buffer.getvalue()
+
+
+def generate_variants(picture):
+    """Renders and stores the variants of `picture.image` and sets them on the (unsaved) picture."""
+    if not picture.image:
+        return {}
+    storage = picture.image.storage
+    base, _ = os.path.splitext(os.path.basename(picture.image.name))
+    variants = {}
+    try:
+        with picture.image.open("rb") as image_file:
+            for size, extension, content in render_variants(image_file):
+                name = storage.save(f"profile/pictures/variants/{base}_{size}.{extension}", ContentFile(content))
+                variants.setdefault(str(size), {})[extension] = name
+    except Exception:
+        # Every save took a reference; a retry would take new ones.
+        for name in ProfilePicture.stored_names(None, variants):
+            storage.delete(name)
+        raise
+    picture.variants = variants
+    return variants
+
+
+def process_picture(picture):
+    """
+    Replaces the uploaded original with a clean re-encode, renders variants and
+    marks the picture ready. If the picture was replaced by a newer upload in
+    the meantime the new files are released and the picture is left alone;
+    the newer upload has its own job.
+    """
+    raw_name = picture.image.name
+    saved = []
+    try:
+        if picture.image:
+            storage = picture.image.storage
+            with storage.open(raw_name, "rb") as image_file:
+                extension, content = render_original(image_file)
+            base, _ = os.path.splitext(os.path.basename(raw_name))
+            picture.image = storage.save(f"profile/pictures/{base}.{extension}", ContentFile(content))
+            saved = [picture.image.name]
+            generate_variants(picture)
+            saved = ProfilePicture.stored_names(picture.image.name, picture.variants)
+
+        with transaction.atomic():
+            current = ProfilePicture.objects.select_for_update().filter(id=picture.id).values_list("image", flat=True).first()
+            if current != raw_name:
+                for name in saved:
+                    storage.delete(name)
+                return picture
+            picture.status = ProfilePicture.READY
+            picture.save(update_fields=["image", "variants", "status", "updated_at"])
+            if raw_name:
+                storage.delete(raw_name)
+    except Exception:
+        # Give back what this attempt stored (a rolled back transaction undid
+        # any release above), so retries don't pile up references and files.
+        for name in saved:
+            storage.delete(name)
+        raise
+    return picture
+
+
+def replace_picture(user, image):
+    """
+    Makes `image` the user's picture and queues it for processing in a single
+    transaction. The row, and so the picture id, is kept; the previous files
+    are released once the new image is committed.
+    """
+    with transaction.atomic():
+        # The lock serializes concurrent uploads for the same user;
+        # update_or_create covers two first uploads racing to insert the row.
+        previous = (
+            ProfilePicture.objects.select_for_update()
+            .filter(custom_user=user)
+            .values_list("image", "variants")
+            .first()
+        )
+        picture, _ = ProfilePicture.objects.update_or_create(
+            custom_user=user,
+            defaults={"image": image, "variants": {}, "status": ProfilePicture.PROCESSING},
+        )
+        ImageJob.objects.create(picture=picture)
+        if previous:
+            release_picture_files(*previous)
+    return picture
+
+
+def process_image_jobs(batch_size=10, max_attempts=3, retry_delay=30, lease=300):
+    """
+    Processes one batch of due image jobs and returns a dict of
+    done/retried/failed counts.
+
+    Jobs are claimed the same way as the email outbox: their `next_attempt_at`
+    is pushed forward by `lease` seconds under a claim token. A job that keeps
+    failing is given up on after `max_attempts` and its picture marked failed;
+    the raw upload is left in place so the picture still has an image.
+    """
+    now = timezone.now()
+    due = ImageJob.objects.filter(status=ImageJob.PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by("next_attempt_at", "id").values_list("id", flat=True)[:batch_size])
+    token = uuid.uuid4().hex
+    due.filter(id__in=ids).update(claim_token=token, next_attempt_at=now + timedelta(seconds=lease))
+    batch = ImageJob.objects.filter(id__in=ids, claim_token=token).select_related("picture").order_by("id")
+
+    results = {"done": 0, "retried": 0, "failed": 0}
+    for job in batch:
+        try:
+            process_picture(job.picture)
+        except Exception as error:
+            results[_record_job_failure(job, repr(error), max_attempts, retry_delay)] += 1
+        else:
+            ImageJob.objects.filter(id=job.id).update(
+                status=ImageJob.DONE,
+                attempts=F("attempts") + 1,
+                finished_at=timezone.now(),
+                last_error="",
+            )
+            results["done"] += 1
+    return results
+
+
+def _record_job_failure(job, error, max_attempts, retry_delay):
+    attempts = job.attempts + 1
+    if attempts >= max_attempts:
+        status, outcome = ImageJob.FAILED, "failed"
+        ProfilePicture.objects.filter(id=job.picture_id).update(status=ProfilePicture.FAILED)
+    else:
+        status, outcome = ImageJob.PENDING, "retried"
+    ImageJob.objects.filter(id=job.id).update(
+        status=status,
+        attempts=attempts,
+        next_attempt_at=timezone.now() + timedelta(seconds=retry_delay * 2 ** (attempts - 1)),
+        last_error=error,
+    )
+    return outcome
+
+
+def iter_stored_files(storage, directory):
+    """Yields the name of every file below `directory`, one directory listing at a time."""
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f"{directory}/{name}"
+    for name in directories:
+        yield from iter_stored_files(storage, f"{directory}/{name}")
+
+
+def collect_orphaned_media(directory="profile/pictures", batch_size=500, min_age=3600, dry_run=False, upload_expiry=None):
+    """
+    Deletes files below `directory` that no ProfilePicture references as its
+    image or a variant, and returns a report:
+
+        {"scanned": 120, "orphans": 7, "deleted": 7, "recent": 1, "bytes": 84211,
+         "orphan_names": [...], "expired_uploads": 2, "elapsed": 0.05, "per_second": 2400.0}
+
+    References are read once up front, then files are checked in batches of
+    `batch_size`. Files modified in the last `min_age` seconds are skipped
+    ("recent"), which covers uploads whose row or job has not caught up yet.
+    With `dry_run` nothing is deleted and "deleted" stays 0.
+
+    Chunked uploads idle for longer than `upload_expiry` seconds
+    (CHUNKED_UPLOAD_EXPIRY by default) are dropped along with their partial
+    files and counted as "expired_uploads".
+    """
+    started = time.perf_counter()
+    storage = ProfilePicture._meta.get_field("image").storage
+    purge = getattr(storage, "purge", storage.delete)
+    referenced = set()
+    for image, variants in ProfilePicture.objects.values_list("image", "variants").iterator(chunk_size=batch_size):
+        referenced.update(ProfilePicture.stored_names(image, variants))
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+
+    report = {"scanned": 0, "orphans": 0, "deleted": 0, "recent": 0, "bytes": 0, "orphan_names": []}
+    batch = []
+
+    def collect(batch):
+        for name in batch:
+            if storage.get_modified_time(name) > cutoff:
+                report["recent"] += 1
+                continue
+            report["orphans"] += 1
+            report["bytes"] += storage.size(name)
+            report["orphan_names"].append(name)
+            if not dry_run:
+                purge(name)
+                report["deleted"] += 1
+
+    if storage.exists(directory):
+        for name in iter_stored_files(storage, directory):
+            report["scanned"] += 1
+            if name in referenced:
+                continue
+            batch.append(name)
+            if len(batch) >= batch_size:
+                collect(batch)
+                batch = []
+        collect(batch)
+
+    if upload_expiry is None:
+        upload_expiry = getattr(settings, "CHUNKED_UPLOAD_EXPIRY", 24 * 60 * 60)
+    expired = ChunkedUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=upload_expiry))
+    report["expired_uploads"] = expired.count()
+    if not dry_run and report["expired_uploads"]:
+        expired.delete()
+
+    report["elapsed"] = time.perf_counter() - started
+    report["per_second"] = report["scanned"] / report["elapsed"] if report["elapsed"] else 0.0
+    return report
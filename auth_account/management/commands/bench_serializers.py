@@ -0,0 +1,66 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from auth_account.models import CustomUser as User, TeacherProfile
+from auth_account.renderers import FastJSONRenderer, orjson
+from auth_account.serializers import TeacherCardSerializer
+
+
+class Command(BaseCommand):
+    help = "Compares TeacherCardSerializer + JSONRenderer with the values() + FastJSONRenderer read path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        queryset = TeacherProfile.objects.cards().order_by("id")
+        self.stdout.write(f"JSON encoder for the fast path: {'orjson' if orjson else 'stdlib json'}")
+
+        with transaction.atomic():
+            created = 0
+            for rows in sorted(options["rows"]):
+                self.create_teachers(created, rows, options["batch_size"])
+                created = rows
+                subset = queryset[:rows]
+
+                serializer_time, serializer_body = self.measure(
+                    lambda: JSONRenderer().render(TeacherCardSerializer(subset, many=True).data)
+                )
+                fast_time, fast_body = self.measure(
+                    lambda: FastJSONRenderer().render(
+                        TeacherCardSerializer.values_rows(TeacherCardSerializer.values_queryset(subset, None), None)
+                    )
+                )
+                self.stdout.write(
+                    f"{rows:>7} rows  serializer {serializer_time:8.3f}s  fast {fast_time:8.3f}s  "
+                    f"speedup {serializer_time / fast_time:5.1f}x  "
+                    f"({len(serializer_body)} / {len(fast_body)} bytes)"
+                )
+
+            transaction.set_rollback(True)
+
+    def create_teachers(self, start, stop, batch_size):
+        for offset in range(start, stop, batch_size):
+            end = min(offset + batch_size, stop)
+            users = User.objects.bulk_create(
+                User(
+                    email=f"bench-teacher{index}@example.com",
+                    username=f"bench-teacher{index}@example.com",
+                    first_name=f"First{index}",
+                    last_name=f"Last{index}",
+                    password="!",
+                    is_teacher=True,
+                )
+                for index in range(offset, end)
+            )
+            TeacherProfile.objects.bulk_create(
+                TeacherProfile(user=user, subject="Quran", experience=index % 30, qualifications="Ijazah")
+                for index, user in enumerate(users)
+            )
+
+    def measure(self, render):
+        started = time.perf_counter()
+        body = render()
+        return time.perf_counter() - started, body
@@ -0,0 +1,64 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from auth_account.authentication import CachedJWTAuthentication, StatelessJWTAuthentication
+from auth_account.cache import user_cache
+from auth_account.models import CustomUser as User
+from auth_account.views import TokenValidationView, get_tokens_for_user
+
+
+class Command(BaseCommand):
+    help = "Compares /auth/validate/token/ throughput with full, cached and stateless JWT authentication."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        factory = APIRequestFactory()
+        modes = [
+            ("full", JWTAuthentication),
+            ("cached", CachedJWTAuthentication),
+            ("stateless", StatelessJWTAuthentication),
+        ]
+
+        with transaction.atomic():
+            user = User.objects.create_user(
+                email="bench-token@example.com",
+                username="bench-token@example.com",
+                first_name="Bench",
+                last_name="Token",
+            )
+            header = f"Bearer {get_tokens_for_user(user)['access']}"
+
+            request = factory.get("/auth/validate/token/", HTTP_AUTHORIZATION=header)
+            for name, authentication_class in modes:
+                # The authenticator alone, then the whole view including DRF dispatch.
+                authenticator = authentication_class()
+                self.report(f"{name} auth", iterations, lambda: authenticator.authenticate(request))
+
+                view = TokenValidationView.as_view(authentication_classes=[authentication_class])
+
+                def validate():
+                    response = view(factory.get("/auth/validate/token/", HTTP_AUTHORIZATION=header))
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{name} validation failed with {response.status_code}")
+
+                self.report(f"{name} view", iterations, validate)
+
+            transaction.set_rollback(True)
+
+    def report(self, name, iterations, check):
+        user_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                check()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{name:<16} {iterations} checks in {elapsed:.3f}s "
+            f"{iterations / elapsed:10.0f} checks/s {len(queries) / iterations:.2f} queries/check"
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from auth_account.images import collect_orphaned_media
+
+
+class Command(BaseCommand):
+    help = "Deletes profile picture files that no ProfilePicture references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", default="profile/pictures", help="Storage directory to scan.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--min-age", type=int, default=3600, help="Skip files modified in the last N seconds.")
+        parser.add_argument("--dry-run", action="store_true", help="Report orphans without deleting them.")
+
+    def handle(self, *args, **options):
+        report = collect_orphaned_media(
+            directory=options["directory"],
+            batch_size=options["batch_size"],
+            min_age=options["min_age"],
+            dry_run=options["dry_run"],
+        )
+        if options["verbosity"] > 1:
+            for name in report["orphan_names"]:
+                self.stdout.write(name)
+        action = "would delete" if options["dry_run"] else "deleted"
+        self.stdout.write(
+            f"Scanned {report['scanned']} files in {report['elapsed']:.2f}s ({report['per_second']:.0f} files/s): "
+            f"{report['orphans']} orphans ({report['bytes']} bytes), {action} "
+            f"{report['orphans'] if options['dry_run'] else report['deleted']}, skipped {report['recent']} recent; "
+            f"{report['expired_uploads']} expired chunked uploads"
+        )
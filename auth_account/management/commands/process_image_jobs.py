@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from auth_account.images import process_image_jobs
+
+
+class Command(BaseCommand):
+    help = "Re-encodes queued profile picture uploads, renders their variants and marks them ready."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10)
+        parser.add_argument("--max-attempts", type=int, default=3)
+        parser.add_argument("--retry-delay", type=int, default=30, help="Seconds before the first retry; doubles per attempt.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the queue instead of exiting once it is drained.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to sleep between polls when idle.")
+
+    def handle(self, *args, **options):
+        totals = {"done": 0, "retried": 0, "failed": 0}
+        while True:
+            results = process_image_jobs(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+                retry_delay=options["retry_delay"],
+            )
+            for key, value in results.items():
+                totals[key] += value
+            if any(results.values()):
+                self.stdout.write(f"done {results['done']}, retried {results['retried']}, failed {results['failed']}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"Image queue drained: done {totals['done']}, retried {totals['retried']}, failed {totals['failed']}")
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from auth_account.utils import Util
+
+
+class Command(BaseCommand):
+    help = "Delivers queued outbox emails in batches over a single SMTP connection per batch."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument("--retry-delay", type=int, default=60, help="Seconds before the first retry; doubles per attempt.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling the outbox instead of exiting once it is drained.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep between polls when idle.")
+
+    def handle(self, *args, **options):
+        totals = {"sent": 0, "retried": 0, "failed": 0}
+        while True:
+            results = Util.send_queued_emails(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+                retry_delay=options["retry_delay"],
+            )
+            for key, value in results.items():
+                totals[key] += value
+            if any(results.values()):
+                self.stdout.write(f"sent {results['sent']}, retried {results['retried']}, failed {results['failed']}")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"Outbox drained: sent {totals['sent']}, retried {totals['retried']}, failed {totals['failed']}")
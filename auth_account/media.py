@@ -0,0 +1,168 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views import View
+from .storage import picture_storage
+
+"""
+Media Serving
+
+Serves MEDIA_ROOT in production. Files are either handed to the front server
+(MEDIA_SENDFILE = "x-accel-redirect" for nginx, "x-sendfile" for Apache or
+lighttpd) or returned as a FileResponse, which WSGI servers with a file wrapper
+(gunicorn, uWSGI) send with sendfile(2). Single byte ranges are answered with
+206 so large pictures can be resumed and seeked, and content addressed names
+are cached forever while everything else is revalidated after
+MEDIA_CACHE_MAX_AGE seconds.
+
+This is a plain Django view rather than an APIView: it needs no
+authentication, negotiation or rendering, only the file.
+"""
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Compressed files are served as what they are, like FileResponse does; a
+# Content-Encoding header would make browsers unpack them.
+COMPRESSED_TYPES = {
+    "br": "application/x-brotli",
+    "bzip2": "application/x-bzip",
+    "compress": "application/x-compress",
+    "gzip": "application/gzip",
+    "xz": "application/x-xz",
+}
+
+
+class RangeFile:
+    """File wrapper that reads at most `length` bytes from the current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # Lets wsgi.file_wrapper sendfile() from the current offset; it stops
+        # at the Content-Length set below.
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Returns `(start, end)` for a single "bytes=" range, None when the header
+    should be ignored (absent, malformed or several ranges) and False when the
+    range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # "bytes=-500" is the last 500 bytes.
+        if int(last) == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+class MediaView(View):
+    http_method_names = ["get", "head"]
+
+    def get(self, request, path):
+        path = posixpath.normpath(path).lstrip("/")
+        uploads = getattr(settings, "CHUNKED_UPLOAD_DIR", "uploads/chunked").strip("/")
+        if path == uploads or path.startswith(uploads + "/"):
+            # Unfinished chunked uploads are never public.
+            raise Http404("Not found")
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise Http404("Not found")
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            raise Http404("Not found")
+        if not os.path.isfile(full_path):
+            raise Http404("Not found")
+
+        etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            response = self.file_response(request, path, full_path, stat, etag)
+        response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(stat.st_mtime)
+        response.headers["Cache-Control"] = self.cache_control(path)
+        return response
+
+    def cache_control(self, path):
+        if picture_storage.is_immutable(path):
+            return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+    def file_response(self, request, path, full_path, stat, etag):
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = COMPRESSED_TYPES.get(encoding, content_type) or "application/octet-stream"
+
+        sendfile = getattr(settings, "MEDIA_SENDFILE", None)
+        if sendfile:
+            # The front server handles ranges and the body itself.
+            response = HttpResponse(content_type=content_type)
+            if sendfile == "x-accel-redirect":
+                prefix = getattr(settings, "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+                response.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(path)
+            else:
+                response.headers["X-Sendfile"] = full_path
+            return response
+
+        size = stat.st_size
+        byte_range = None
+        if self.range_applies(request, etag, stat):
+            byte_range = parse_range(request.headers.get("Range"), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+
+        file = open(full_path, "rb")
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = byte_range
+            file.seek(start)
+            response = FileResponse(RangeFile(file, end - start + 1), status=206, content_type=content_type)
+            response.headers["Content-Length"] = str(end - start + 1)
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response.headers["Accept-Ranges"] = "bytes"
+        return response
+
+    def range_applies(self, request, etag, stat):
+        # A range is only honoured against the representation the client
+        # already has, as named by If-Range; otherwise the whole file is sent.
+        if_range = request.headers.get("If-Range")
+        if not if_range:
+            return True
+        if if_range.startswith('"'):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == int(stat.st_mtime)
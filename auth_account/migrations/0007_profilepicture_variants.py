@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_account', '0006_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilepicture',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:01
+
+import auth_account.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_account', '0008_profilepicture_status_imagejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='profilepicture',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=auth_account.storage.ContentAddressedStorage(), upload_to='profile/pictures'),
+        ),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
+import os
+import uuid
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .authentication import token_revocations
+from .cache import invalidate_directory_cache, user_cache
+from .storage import picture_storage
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -10,7 +18,14 @@ class CustomUserManager(BaseUserManager):
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
-        user.save(using=self._db)
+        # The user and their student/teacher profile are created together, so a
+        # user never exists without the profile their role needs.
+        with transaction.atomic(using=self._db):
+            user.save(using=self._db)
+            if user.is_student:
+                StudentProfile.objects.using(self._db).create(user=user)
+            if user.is_teacher:
+                TeacherProfile.objects.using(self._db).create(user=user)
         return user
 
     def create_superuser(self, email, password=None, **extra_fields):
@@ -38,6 +53,7 @@ class CustomUser(AbstractUser):
     is_teacher = models.BooleanField(default=False)
     bio = models.TextField(blank=True)
     address = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     objects = CustomUserManager()
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = [
@@ -63,14 +79,34 @@ class CustomUser(AbstractUser):
         self.is_admin = value
 
 class ProfilePicture(models.Model):
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PROCESSING, "Processing"),
+        (READY, "Ready"),
+        (FAILED, "Failed"),
+    ]
+
     custom_user = models.OneToOneField(
         CustomUser, on_delete=models.CASCADE, related_name="profile_picture"
     )
-    image = models.ImageField(upload_to="profile/pictures", null=True, blank=True)
+    image = models.ImageField(upload_to="profile/pictures", storage=picture_storage, null=True, blank=True)
+    variants = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"{self.custom_user.email} ProfilePicture"
 
+    @staticmethod
+    def stored_names(image, variants):
+        """Storage names held by a picture: the original and every variant."""
+        names = [image] if image else []
+        for formats in (variants or {}).values():
+            names.extend(name for name in formats.values() if name)
+        return names
+
 class StudentProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='student_profile')
     enrolled_date = models.DateField(null=True, blank=True)
@@ -81,27 +117,188 @@ class StudentProfile(models.Model):
     def __str__(self):
         return f"{self.user.email} StudentProfile"
 
+class TeacherProfileQuerySet(models.QuerySet):
+    def cards(self):
+        """Teachers with their user joined in and only the columns a directory card shows."""
+        return self.select_related("user").only(
+            "id",
+            "subject",
+            "experience",
+            "qualifications",
+            "user__first_name",
+            "user__last_name",
+            "user__email",
+        )
+
 class TeacherProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='teacher_profile')
     subject = models.CharField(max_length=100, null=True, blank=True)
     experience = models.IntegerField(null=True, blank=True)
     qualifications = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = TeacherProfileQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.email} TeacherProfile"
 
+class OutboundEmail(models.Model):
+    """
+    Outbox row for an email that is sent by the `send_queued_emails` worker
+    instead of on the request thread.
+    """
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to_email = models.EmailField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.to_email} {self.subject} ({self.status})"
+
+class MediaBlob(models.Model):
+    """A file kept by ContentAddressedStorage and how many stored names point at it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.references} references)"
+
+class ChunkedUpload(models.Model):
+    """
+    A profile picture sent in pieces. The bytes received so far are kept in
+    `path` until the upload is finalized and handed to ProfilePicture.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="chunked_uploads")
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @property
+    def path(self):
+        directory = getattr(settings, "CHUNKED_UPLOAD_DIR", "uploads/chunked")
+        return os.path.join(settings.MEDIA_ROOT, directory, f"{self.id.hex}.part")
+
+    def __str__(self):
+        return f"{self.user.email} {self.filename} ({self.offset}/{self.size})"
+
+class ImageJob(models.Model):
+    """
+    Queue row for a profile picture upload that is re-encoded and rendered
+    into variants by the `process_image_jobs` worker.
+    """
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    picture = models.ForeignKey(ProfilePicture, on_delete=models.CASCADE, related_name="jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.picture} job ({self.status})"
+
 # Signal handlers
 @receiver(post_save, sender=CustomUser)
-def create_profile(sender, instance, created, **kwargs):
-    if created:
-        if instance.is_student:
-            StudentProfile.objects.create(user=instance)
-        if instance.is_teacher:
-            TeacherProfile.objects.create(user=instance)
+@receiver(post_save, sender=TeacherProfile)
+@receiver(post_save, sender=ProfilePicture)
+def touch_directory(sender, instance, **kwargs):
+    # After commit: a request between a new stamp and the commit would cache
+    # the old rows under it.
+    last_modified = instance.updated_at
+    transaction.on_commit(lambda: invalidate_directory_cache(last_modified))
+
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_delete, sender=TeacherProfile)
+@receiver(post_delete, sender=ProfilePicture)
+def invalidate_directory(sender, **kwargs):
+    transaction.on_commit(invalidate_directory_cache)
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # After commit, like the directory cache: a lookup between the bump and
+    # the commit would store the old row under the new version.
+    user_pk = instance.pk
+    transaction.on_commit(lambda: user_cache.invalidate(user_pk))
 
 @receiver(post_save, sender=CustomUser)
-def save_profile(sender, instance, **kwargs):
-    if instance.is_student:
-        instance.student_profile.save()
-    if instance.is_teacher:
-        instance.teacher_profile.save()
+def revoke_tokens(sender, instance, created, **kwargs):
+    # Mirror what full authentication would reject so the stateless token check
+    # agrees with it: inactive users, and password changes when the token
+    # carries a password hash claim. `_password` is still set during post_save.
+    # A new user has no tokens to revoke.
+    if created:
+        return
+    password_changed = instance._password is not None and jwt_settings.CHECK_REVOKE_TOKEN
+    if not instance.is_active or password_changed:
+        token_revocations.revoke_user(instance.pk)
+
+@receiver(post_delete, sender=CustomUser)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    token_revocations.revoke_user(instance.pk)
+
+def release_picture_files(image, variants):
+    """
+    Releases a replaced or deleted picture's files once the current transaction
+    commits, so a rollback keeps them; `collect_orphaned_media` removes the
+    files that are no longer referenced.
+    """
+    if not getattr(settings, "PROFILE_PICTURE_DELETE_FILES", True):
+        return
+    storage = ProfilePicture._meta.get_field("image").storage
+    names = ProfilePicture.stored_names(image, variants)
+    if names:
+        transaction.on_commit(lambda: [storage.delete(name) for name in names])
+
+@receiver(post_delete, sender=ProfilePicture)
+def release_deleted_picture_files(sender, instance, **kwargs):
+    release_picture_files(instance.image.name, instance.variants)
+
+@receiver(post_delete, sender=ChunkedUpload)
+def remove_chunked_upload_file(sender, instance, **kwargs):
+    path = instance.path
+
+    def remove():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    transaction.on_commit(remove)
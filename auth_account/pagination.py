@@ -0,0 +1,18 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class DirectoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the public directory listings.
+
+    Pages are ordered on the primary key and the opaque `cursor` only encodes the
+    last id seen, so every page is a `WHERE id > ... LIMIT n` query and deep pages
+    cost the same as the first one. Clients may pick a smaller or larger page with
+    `?page_size=`, capped at DIRECTORY_MAX_PAGE_SIZE.
+    """
+
+    ordering = "id"
+    page_size = getattr(settings, "DIRECTORY_PAGE_SIZE", 50)
+    page_size_query_param = "page_size"
+    max_page_size = getattr(settings, "DIRECTORY_MAX_PAGE_SIZE", 200)
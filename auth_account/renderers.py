@@ -0,0 +1,58 @@
+import json
+from itertools import islice
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def json_dumps(data):
+    """
+    Encodes `data` to compact JSON bytes with orjson when it is installed and the
+    stdlib encoder otherwise. Types neither knows natively (Decimal, lazy
+    strings, ...) go through DRF's JSONEncoder, as with JSONRenderer.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_encoder.default)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with `json_dumps`. Indented output (the browsable
+    API, `; indent=` media types) still goes through JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return json_dumps(data)
+
+
+def iter_json_array(rows, chunk_size=2000, transform=None):
+    """
+    Encodes an iterable of rows as one JSON array, yielding a bytes chunk per
+    `chunk_size` rows, so arbitrarily long listings can be streamed without
+    holding them in memory. `transform` is applied to each chunk (a list of
+    rows) before it is encoded.
+    """
+    rows = iter(rows)
+    yield b"["
+    first = True
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        if transform is not None:
+            chunk = transform(chunk)
+        body = b",".join(json_dumps(row) for row in chunk)
+        yield body if first else b"," + body
+        first = False
+    yield b"]"
@@ -1,3 +1,4 @@
+import os
 from django.core.mail import EmailMessage
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_bytes, smart_str, DjangoUnicodeDecodeError
@@ -6,9 +7,211 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.template.loader import render_to_string
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from .models import CustomUser as User, ProfilePicture, StudentProfile, TeacherProfile
+from rest_framework.settings import api_settings
+from .models import ChunkedUpload, CustomUser as User, ProfilePicture, StudentProfile, TeacherProfile
+from .images import replace_picture
 from .utils import Util
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import F
+
+"""
+Sparse Fieldsets
+"""
+
+
+class MediaPathImageField(serializers.ImageField):
+    """
+    ImageField that always renders the storage URL ("/media/..."). DRF's makes
+    it absolute whenever the request is in the context, which the sparse
+    fieldsets need, but clients have always received media paths.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not getattr(self, "use_url", api_settings.UPLOADED_FILES_USE_URL):
+            return value.name
+        return value.url
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients ask for a subset of a serializer's fields with
+    `?fields=first_name,last_name` or drop some with `?exclude=bio`. Only the
+    top-level serializer that was given the request in its context is pruned,
+    and only when reading: a serializer given data keeps every field so no
+    write is dropped. `prune_queryset` narrows the queryset to the columns the
+    remaining fields read, so a smaller payload is also a cheaper query.
+    """
+
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: MediaPathImageField,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if hasattr(self, "initial_data"):
+            return
+        selected, excluded = self.get_requested_fields()
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+        for name in excluded & set(self.fields):
+            self.fields.pop(name)
+
+    def get_requested_fields(self):
+        request = self.context.get("request")
+        if request is None or self.parent is not None and not isinstance(self.parent, serializers.ListSerializer):
+            return None, set()
+        params = getattr(request, "query_params", request.GET)
+        selected = params.get("fields")
+        excluded = params.get("exclude")
+        return (
+            {name.strip() for name in selected.split(",") if name.strip()} if selected else None,
+            {name.strip() for name in excluded.split(",") if name.strip()} if excluded else set(),
+        )
+
+    def get_model_columns(self):
+        """
+        Returns the `only()` paths the current fields read, or None when a field
+        reads something other than a model column and nothing can be deferred.
+        """
+        columns = ["pk"]
+        for field in self.fields.values():
+            if field.source == "*":
+                return None
+            if isinstance(field, serializers.BaseSerializer):
+                continue
+            model = self.Meta.model
+            parts = field.source.split(".")
+            path = []
+            for index, part in enumerate(parts):
+                try:
+                    model_field = model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    # Sources may also use a foreign key's attname (teacher_id).
+                    attnames = {f.attname: f for f in model._meta.concrete_fields}
+                    if part not in attnames:
+                        return None
+                    model_field = attnames[part]
+                path.append(model_field.name)
+                if model_field.is_relation and not model_field.concrete:
+                    # Reverse relations are loaded by their own query.
+                    path = None
+                    break
+                if model_field.is_relation and index < len(parts) - 1:
+                    model = model_field.related_model
+            if path:
+                columns.append("__".join(path))
+        return columns
+
+    @classmethod
+    def prune_queryset(cls, queryset, request):
+        serializer = cls(context={"request": request})
+        selected, excluded = serializer.get_requested_fields()
+        if selected is None and not excluded:
+            return queryset
+        columns = serializer.get_model_columns()
+        if columns is None:
+            return queryset
+        queryset = queryset.select_related(None)
+        relations = {column.rsplit("__", 1)[0] for column in columns if "__" in column}
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*columns)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Renders a picture's stored variant names ({"128": {"webp": name}}) as media
+    URLs, like the picture's `image`.
+    """
+
+    def __init__(self, storage, **kwargs):
+        self.storage = storage
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        urls = {}
+        for size, names in (value or {}).items():
+            urls[size] = {extension: self.storage.url(name) for extension, name in names.items()}
+        return urls
+
+
+"""
+Read-only values() path
+"""
+
+
+class ValuesProjectionMixin:
+    """
+    Fast read path for list endpoints. `values_queryset` turns a queryset into a
+    `values()` projection of the serializer's fields (named like the fields, so
+    `user.first_name` becomes `user_first_name`), and `values_rows` finishes the
+    rows into exactly what the serializer would have returned, without creating
+    model instances or running a serializer per row. Only plain scalar and file
+    fields are supported. The primary key is always projected so keyset
+    pagination keeps working, and is dropped again if it was not asked for.
+    """
+
+    values_field_types = (
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.FloatField,
+        serializers.BooleanField,
+        serializers.ChoiceField,
+        serializers.DateField,
+        serializers.FileField,
+        ImageVariantsField,
+    )
+
+    def get_values_projection(self):
+        # values("teacher") already yields the key's id, and F("teacher_id")
+        # could not be projected under the name "teacher" anyway.
+        attnames = {f.attname: f.name for f in self.Meta.model._meta.concrete_fields}
+        projection = {}
+        for name, field in self.fields.items():
+            if field.source == "*" or not isinstance(field, self.values_field_types):
+                raise TypeError(f"{self.__class__.__name__}.{name} cannot be read through values()")
+            path = field.source.replace(".", "__")
+            projection[name] = attnames.get(path, path)
+        return projection
+
+    @classmethod
+    def values_queryset(cls, queryset, request):
+        projection = cls(context={"request": request}).get_values_projection()
+        names = [name for name, path in projection.items() if name == path]
+        expressions = {name: F(path) for name, path in projection.items() if name != path}
+        if "id" not in projection:
+            names.append("id")
+        return queryset.values(*names, **expressions)
+
+    @classmethod
+    def values_rows(cls, rows, request):
+        serializer = cls(context={"request": request})
+        names = list(serializer.fields)
+        model = cls.Meta.model
+        file_storages = {
+            name: model._meta.get_field(field.source).storage
+            for name, field in serializer.fields.items()
+            if isinstance(field, serializers.FileField)
+        }
+        variant_fields = {
+            name: field for name, field in serializer.fields.items() if isinstance(field, ImageVariantsField)
+        }
+        data = []
+        for row in rows:
+            for name, field in variant_fields.items():
+                row[name] = field.to_representation(row[name])
+            for name, storage in file_storages.items():
+                row[name] = storage.url(row[name]) if row[name] else None
+            data.append({name: row[name] for name in names})
+        return data
+
 
 """
 Customized User Model
@@ -78,7 +281,7 @@ class EmailVerificationSerializer(serializers.Serializer):
         self.send_verification_email(user)
 
 
-class ProfilePictureSerializer(serializers.ModelSerializer):
+class ProfilePictureSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ProfilePicture
         fields = ["custom_user", "image"]
@@ -90,7 +293,7 @@ We can add bio, address and much much more as we need later to get more profile
 """
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     profile_picture = ProfilePictureSerializer(required=False)
 
     class Meta:
@@ -104,14 +307,9 @@ class UserProfileSerializer(serializers.ModelSerializer):
         instance.bio = validated_data.get("bio", instance.bio)
         instance.address = validated_data.get("address", instance.address)
 
-        profile_picture_data = validated_data.pop("profile_picture", None)
-        if profile_picture_data:
-            profile_picture = instance.profile_picture
-            if profile_picture:
-                profile_picture.image = profile_picture_data.get("image", profile_picture.image)
-                profile_picture.save()
-            else:
-                ProfilePicture.objects.create(custom_user=instance, **profile_picture_data)
+        profile_picture_data = validated_data.pop("profile_picture", None) or {}
+        if profile_picture_data.get("image"):
+            instance.profile_picture = replace_picture(instance, profile_picture_data["image"])
 
         instance.save()
         return instance
@@ -189,7 +387,7 @@ class SendPasswordResetEmailSerializer(serializers.Serializer):
                 "email_body": body,
                 "to_email": user.email,
             }
-            Util.send_email(data)
+            Util.queue_email(data)
             return attrs
         else:
             raise serializers.ValidationError("User with this email does not exist.")
@@ -253,7 +451,7 @@ class UserPasswordResetSerializer(serializers.Serializer):
 Student and Teacher Profile Serializers
 """
 
-class StudentProfileSerializer(serializers.ModelSerializer):
+class StudentProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
@@ -286,7 +484,7 @@ class StudentProfileSerializer(serializers.ModelSerializer):
         return instance
 
 
-class TeacherProfileSerializer(serializers.ModelSerializer):
+class TeacherProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True, default=serializers.CurrentUserDefault())
 
 
@@ -318,7 +516,17 @@ class TeacherProfileSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
     
-class TeacherCardSerializer(serializers.ModelSerializer):
+class StudentCardSerializer(SparseFieldsMixin, ValuesProjectionMixin, serializers.ModelSerializer):
+    user_first_name = serializers.CharField(source='user.first_name')
+    user_last_name = serializers.CharField(source='user.last_name')
+    user_email = serializers.EmailField(source='user.email')
+    teacher = serializers.IntegerField(source='teacher_id', allow_null=True)
+
+    class Meta:
+        model = StudentProfile
+        fields = ['id', 'user_first_name', 'user_last_name', 'user_email', 'enrolled_date', 'teacher', 'grade', 'parent_contact']
+
+class TeacherCardSerializer(SparseFieldsMixin, ValuesProjectionMixin, serializers.ModelSerializer):
     user_first_name = serializers.CharField(source='user.first_name')
     user_last_name = serializers.CharField(source='user.last_name')
     user_email = serializers.EmailField(source='user.email')
@@ -327,10 +535,67 @@ class TeacherCardSerializer(serializers.ModelSerializer):
         model = TeacherProfile
         fields = ['id', 'user_first_name', 'user_last_name', 'user_email', 'subject', 'experience', 'qualifications']
 
-class ProfilePictureSerializer(serializers.ModelSerializer):
-    user_first_name = serializers.CharField(source='custom_user.first_name')
-    user_last_name = serializers.CharField(source='custom_user.last_name')
+class ProfilePictureSerializer(SparseFieldsMixin, ValuesProjectionMixin, serializers.ModelSerializer):
+    user_first_name = serializers.CharField(source='custom_user.first_name', read_only=True)
+    user_last_name = serializers.CharField(source='custom_user.last_name', read_only=True)
+    variants = ImageVariantsField(storage=ProfilePicture._meta.get_field('image').storage)
 
     class Meta:
         model = ProfilePicture
-        fields = ['id', 'user_first_name', 'user_last_name', 'image']
\ No newline at end of file
+        fields = ['id', 'user_first_name', 'user_last_name', 'image', 'variants', 'status']
+        read_only_fields = ['status']
+
+
+"""
+Resumable profile picture uploads
+"""
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$", write_only=True)
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ["id", "filename", "size", "sha256", "offset"]
+        read_only_fields = ["id", "offset"]
+
+    def validate_size(self, value):
+        max_size = getattr(settings, "CHUNKED_UPLOAD_MAX_SIZE", 20 * 1024 * 1024)
+        if not 0 < value <= max_size:
+            raise serializers.ValidationError(f"Size must be between 1 and {max_size} bytes.")
+        return value
+
+    def validate_filename(self, value):
+        # Only the name is kept; the picture is stored under its own path.
+        value = os.path.basename(value.replace("\\", "/"))
+        if not value:
+            raise serializers.ValidationError("A file name is required.")
+        return value
+
+    def validate_sha256(self, value):
+        return value.lower()
+
+
+"""
+Aggregated "me" payload: the user with their picture and both role profiles
+"""
+
+class MeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    profile_picture = ProfilePictureSerializer(read_only=True, allow_null=True)
+    student_profile = StudentProfileSerializer(read_only=True, allow_null=True)
+    teacher_profile = TeacherProfileSerializer(read_only=True, allow_null=True)
+
+    class Meta:
+        model = User
+        fields = [
+            "id",
+            "first_name",
+            "last_name",
+            "email",
+            "bio",
+            "address",
+            "is_student",
+            "is_teacher",
+            "profile_picture",
+            "student_profile",
+            "teacher_profile",
+        ]
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import re
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+"""
+Content Addressed Storage
+
+Files are named after the sha256 of their bytes, so identical uploads are
+stored once and a name never points at different content. Every `save` takes a
+reference on the stored file (tracked as a MediaBlob row) and every `delete`
+releases one. Releasing the last reference drops the row but leaves the file:
+the same bytes can be saved again at any moment, and only
+`collect_orphaned_media`, which skips files modified within its grace period
+(`_save` refreshes the mtime of a file it reuses), can remove one safely.
+
+Names look like "<dir>/<first two hex digits>/<sha256>.<ext>", where <dir> is
+the directory the caller asked for (`upload_to`, "profile/pictures/variants").
+Since the bytes behind such a name never change, its URL can be cached forever.
+Files stored before this backend keep their names and are deleted as before.
+"""
+
+HASHED_NAME = re.compile(r"(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]+)?$")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        sha = digest.hexdigest()
+        directory = os.path.dirname(name)
+        _, extension = os.path.splitext(name)
+        return os.path.join(directory, sha[:2], f"{sha}{extension.lower()}").replace("\\", "/")
+
+    def is_immutable(self, name):
+        """Whether `name` is content addressed, i.e. its bytes can never change."""
+        return bool(name and HASHED_NAME.search(name))
+
+    def _save(self, name, content):
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            # Refresh the mtime so the orphan collector's grace period covers
+            # a file that is being referenced again.
+            os.utime(self.path(name))
+        else:
+            saved = super()._save(name, content)
+            if saved != name:
+                # An identical upload was written between the exists() check
+                # and ours; keep theirs.
+                super().delete(saved)
+        self._acquire(name, content.size)
+        return name
+
+    def delete(self, name):
+        if not self.is_immutable(name):
+            return super().delete(name)
+        self._release(name)
+
+    def references(self, name):
+        blob = self._blobs().filter(name=name).values_list("references", flat=True).first()
+        return blob or 0
+
+    def purge(self, name):
+        """Removes the file and its MediaBlob regardless of the reference count."""
+        self._blobs().filter(name=name).delete()
+        super().delete(name)
+
+    def _blobs(self):
+        return apps.get_model("auth_account", "MediaBlob").objects
+
+    def _acquire(self, name, size):
+        with transaction.atomic():
+            blob, created = self._blobs().select_for_update().get_or_create(name=name, defaults={"size": size})
+            if not created:
+                self._blobs().filter(pk=blob.pk).update(references=F("references") + 1)
+
+    def _release(self, name):
+        """Drops one reference, and the MediaBlob with the last one."""
+        with transaction.atomic():
+            blob = self._blobs().select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.references > 1:
+                self._blobs().filter(pk=blob.pk).update(references=F("references") - 1)
+            else:
+                blob.delete()
+
+
+picture_storage = ContentAddressedStorage()
@@ -1,3 +1,1323 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from django.core import mail
+from django.core.cache import cache
+from django.core.files import locks
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from PIL import Image
+from . import hashers, images
+from .authentication import token_revocations
+from .cache import SingleFlight, UserCache, get_directory_version, invalidate_directory_cache, single_flight, user_cache
+from .hashers import PooledPBKDF2PasswordHasher, shutdown_hashing_pool
+from .models import ChunkedUpload, CustomUser as User, ImageJob, MediaBlob, OutboundEmail, ProfilePicture, StudentProfile, TeacherProfile
+from .renderers import FastJSONRenderer
+from .serializers import UserProfileSerializer
+from .storage import picture_storage
+from .utils import Util
+from .views import AllTeachersView, AllTeacherImagesView, TeachersExportView, get_tokens_for_user
 
-# Create your tests here.
+
+def create_teacher(index, **extra_fields):
+    return User.objects.create_user(
+        email=f"teacher{index}@example.com",
+        username=f"teacher{index}@example.com",
+        first_name=f"First{index}",
+        last_name=f"Last{index}",
+        is_teacher=True,
+        **extra_fields,
+    )
+
+
+def make_image(name="avatar.png", size=(800, 600), mode="RGBA", format="PNG", color=(200, 30, 30)):
+    buffer = BytesIO()
+    Image.new(mode, size, (*color, 255) if mode == "RGBA" else color).save(buffer, format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f"image/{format.lower()}")
+
+
+class TemporaryMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+
+"""
+Public Directory
+"""
+
+
+class AllTeachersViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for index in range(25):
+            user = create_teacher(index)
+            ProfilePicture.objects.create(custom_user=user, image=f"profile/pictures/{index}.png")
+        # The version stamp is seeded once per cache lifetime, outside the budget.
+        get_directory_version()
+
+    def test_teachers_stay_within_query_budget(self):
+        with self.assertNumQueries(AllTeachersView.query_budget):
+            response = self.client.get(reverse("all_teachers"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 25)
+        self.assertEqual(
+            set(response.data["results"][0]),
+            {"id", "user_first_name", "user_last_name", "user_email", "subject", "experience", "qualifications"},
+        )
+
+    def test_teacher_images_stay_within_query_budget(self):
+        with self.assertNumQueries(AllTeacherImagesView.query_budget):
+            response = self.client.get(reverse("all_teacher_images"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 25)
+        self.assertEqual(response.data["results"][0]["user_first_name"], "First0")
+
+    def test_teachers_are_cursor_paginated_by_id(self):
+        seen = []
+        url = reverse("all_teachers") + "?page_size=10"
+        while url:
+            with self.assertNumQueries(AllTeachersView.query_budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 10)
+            seen.extend(teacher["id"] for teacher in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_client_can_choose_page_size(self):
+        response = self.client.get(reverse("all_teacher_images") + "?page_size=5")
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertIsNotNone(response.data["next"])
+        self.assertIsNone(response.data["previous"])
+
+
+class DirectoryCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = create_teacher(1)
+
+    def test_misses_right_after_a_write_are_rebuilt_on_the_primary(self):
+        view = AllTeachersView()
+        self.assertTrue(view.build_on_primary(None))
+        invalidate_directory_cache(timezone.now() - timedelta(minutes=1))
+        self.assertFalse(view.build_on_primary(None))
+
+    def test_conditional_get_returns_not_modified_without_queries(self):
+        first = self.client.get(reverse("all_teachers"))
+        self.assertTrue(first.has_header("ETag"))
+        self.assertTrue(first.has_header("Last-Modified"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("all_teachers"), HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_etag_changes_with_the_data_and_the_page(self):
+        etag = self.client.get(reverse("all_teacher_images"))["ETag"]
+        self.assertNotEqual(etag, self.client.get(reverse("all_teacher_images") + "?page_size=1")["ETag"])
+        with self.captureOnCommitCallbacks(execute=True):
+            ProfilePicture.objects.create(custom_user=self.teacher, image="profile/pictures/1.png")
+        response = self.client.get(reverse("all_teacher_images"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_renderings_of_a_url_have_their_own_etag_and_entry(self):
+        json_response = self.client.get(reverse("all_teachers"))
+        html = self.client.get(reverse("all_teachers"), HTTP_ACCEPT="text/html", HTTP_IF_NONE_MATCH=json_response["ETag"])
+        self.assertEqual(html.status_code, status.HTTP_200_OK)
+        self.assertEqual(html["X-Cache"], "MISS")
+        self.assertTrue(html["Content-Type"].startswith("text/html"))
+        self.assertNotEqual(html["ETag"], json_response["ETag"])
+        not_modified = self.client.get(reverse("all_teachers"), HTTP_IF_NONE_MATCH=json_response["ETag"])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        for response in (json_response, html, not_modified):
+            self.assertIn("Accept", response["Vary"])
+
+    def test_seeded_version_stamp_is_stable_across_cache_restarts(self):
+        cache.clear()
+        etag = self.client.get(reverse("all_teachers"))["ETag"]
+        cache.clear()
+        self.assertEqual(self.client.get(reverse("all_teachers"))["ETag"], etag)
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get(reverse("all_teachers"))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse("all_teachers"))
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+
+    def test_saving_a_teacher_invalidates_the_cache(self):
+        self.client.get(reverse("all_teachers"))
+        self.teacher.first_name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.save()
+        response = self.client.get(reverse("all_teachers"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["user_first_name"], "Renamed")
+
+    def test_deleting_a_picture_invalidates_the_cache(self):
+        picture = ProfilePicture.objects.create(custom_user=self.teacher, image="profile/pictures/1.png")
+        self.assertEqual(len(self.client.get(reverse("all_teacher_images")).data["results"]), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            picture.delete()
+        response = self.client.get(reverse("all_teacher_images"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"], [])
+
+    def test_stats_are_admin_only(self):
+        self.client.get(reverse("all_teachers"))
+        self.client.get(reverse("all_teachers"))
+        self.assertEqual(self.client.get(reverse("directory_cache_stats")).status_code, status.HTTP_401_UNAUTHORIZED)
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin@example.com")
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse("directory_cache_stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["hits"], 1)
+        self.assertEqual(response.data["misses"], 1)
+
+    def test_expired_page_is_served_stale_while_another_request_rebuilds(self):
+        with mock.patch.object(AllTeachersView, "cache_timeout", 0):
+            self.client.get(reverse("all_teachers"))
+            with mock.patch.object(single_flight, "in_flight", return_value=True), self.assertNumQueries(0):
+                stale = self.client.get(reverse("all_teachers"))
+            revalidated = self.client.get(reverse("all_teachers"))
+        self.assertEqual(stale["X-Cache"], "STALE")
+        self.assertEqual(revalidated["X-Cache"], "MISS")
+
+
+class DirectoryInvalidationCommitTests(TransactionTestCase):
+    def read_concurrently(self, url):
+        responses = []
+
+        def read():
+            try:
+                responses.append(APIClient().get(url))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        return responses[0]
+
+    def test_a_read_before_the_commit_does_not_cache_the_old_rows_under_the_new_stamp(self):
+        cache.clear()
+        teacher = create_teacher(1)
+        self.client.get(reverse("all_teachers"))
+        with transaction.atomic():
+            teacher.first_name = "Renamed"
+            teacher.save()
+            during = self.read_concurrently(reverse("all_teachers"))
+        self.assertEqual(during.data["results"][0]["user_first_name"], "First1")
+
+        response = self.client.get(reverse("all_teachers"))
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data["results"][0]["user_first_name"], "Renamed")
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return "payload"
+
+        def worker():
+            results.append(flight.do("key", build))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, shared in results], ["payload"] * 8)
+        self.assertEqual(sum(1 for result, shared in results if not shared), 1)
+        self.assertFalse(flight.in_flight("key"))
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = SingleFlight()
+        with self.assertRaises(RuntimeError):
+            flight.do("key", mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(flight.do("key", lambda: "ok"), ("ok", False))
+
+
+"""
+Authentication
+"""
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        token_revocations.clear()
+        self.user = create_teacher(1)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def test_user_is_looked_up_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse("user_login")).status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse("user_login")).status_code, status.HTTP_200_OK)
+
+    def test_saving_the_user_invalidates_the_entry(self):
+        self.client.get(reverse("user_login"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get(reverse("user_login"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates_the_entry(self):
+        self.client.get(reverse("user_login"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("a-new-password")
+            self.user.save()
+        with self.assertNumQueries(1):
+            self.client.get(reverse("user_login"))
+
+    def test_invalidation_waits_for_the_commit(self):
+        version = user_cache.version(self.user.pk)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save()
+        self.assertEqual(user_cache.version(self.user.pk), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(user_cache.version(self.user.pk), version)
+
+
+class UserCacheTests(SimpleTestCase):
+    def test_is_bounded_and_evicts_least_recently_used(self):
+        users = UserCache(maxsize=2, ttl=60)
+        for user_id in (1, 2):
+            users.set(user_id, users.version(user_id), User(pk=user_id))
+        users.get(1)
+        users.set(3, users.version(3), User(pk=3))
+        self.assertEqual(len(users), 2)
+        self.assertIsNotNone(users.get(1))
+        self.assertIsNone(users.get(2))
+
+    def test_entries_expire(self):
+        users = UserCache(maxsize=2, ttl=0)
+        users.set(1, users.version(1), User(pk=1))
+        self.assertIsNone(users.get(1))
+
+    def test_stale_lookup_is_not_stored_after_invalidation(self):
+        users = UserCache(maxsize=2, ttl=60)
+        version = users.version(1)
+        users.invalidate(1)
+        users.set(1, version, User(pk=1))
+        self.assertIsNone(users.get(1))
+
+    def test_versions_are_bounded(self):
+        users = UserCache(maxsize=2, ttl=60)
+        for user_id in range(10):
+            users.invalidate(user_id)
+        self.assertEqual(len(users._versions), 2)
+
+    def test_stale_lookup_is_not_stored_after_its_version_is_evicted(self):
+        users = UserCache(maxsize=1, ttl=60)
+        version = users.version(1)
+        users.invalidate(1)
+        users.invalidate(2)
+        users.set(1, version, User(pk=1))
+        self.assertIsNone(users.get(1))
+        users.set(1, users.version(1), User(pk=1))
+        self.assertIsNotNone(users.get(1))
+
+    def test_returns_copies(self):
+        users = UserCache(maxsize=2, ttl=60)
+        users.set(1, users.version(1), User(pk=1, first_name="Cached"))
+        users.get(1).first_name = "Changed"
+        self.assertEqual(users.get(1).first_name, "Cached")
+
+
+class StatelessTokenValidationTests(APITestCase):
+    def setUp(self):
+        token_revocations.clear()
+        self.user = create_teacher(1)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def test_validates_without_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("validate_token"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_rejects_missing_and_tampered_tokens(self):
+        token = get_tokens_for_user(self.user)["access"]
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse("validate_token")).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token[:-4]}AAAA")
+        response = self.client.get(reverse("validate_token"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_the_token(self):
+        self.assertEqual(self.client.post(reverse("logout")).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse("validate_token")).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get(reverse("profile")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivating_the_user_revokes_their_tokens(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("validate_token")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_issued_after_a_revocation_in_the_same_second_are_valid(self):
+        self.user.is_active = False
+        self.user.save()
+        self.user.is_active = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+        self.assertEqual(self.client.get(reverse("validate_token")).status_code, status.HTTP_200_OK)
+
+    def test_revocation_compares_below_the_second(self):
+        with mock.patch("auth_account.authentication.time.time", return_value=1000.5):
+            token_revocations.revoke_user(self.user.pk)
+        self.assertTrue(token_revocations.is_revoked({"user_id": self.user.pk, "iat": 1000.4}))
+        self.assertFalse(token_revocations.is_revoked({"user_id": self.user.pk, "iat": 1000.6}))
+
+    def test_user_revocations_are_dropped_once_their_tokens_have_expired(self):
+        lifetime = jwt_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+        with mock.patch("auth_account.authentication.time.time", return_value=1000.0):
+            token_revocations.revoke_user(self.user.pk)
+        with mock.patch("auth_account.authentication.time.time", return_value=1000.0 + lifetime):
+            token_revocations.revoke_user(self.user.pk + 1)
+        self.assertNotIn(str(self.user.pk), token_revocations._users)
+        self.assertIn(str(self.user.pk + 1), token_revocations._users)
+
+    def test_creating_an_inactive_user_does_not_revoke(self):
+        user = create_teacher(2, is_active=False)
+        self.assertNotIn(str(user.pk), token_revocations._users)
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command("bench_token_validation", iterations=3, stdout=out)
+        self.assertIn("stateless", out.getvalue())
+        self.assertIn("0.00 queries/check", out.getvalue())
+
+
+class PooledPasswordHasherTests(APITestCase):
+    def setUp(self):
+        shutdown_hashing_pool()
+        self.addCleanup(shutdown_hashing_pool)
+
+    def test_matches_the_default_pbkdf2_hasher(self):
+        with self.settings(PASSWORD_HASHING_WORKERS=1):
+            encoded = PooledPBKDF2PasswordHasher().encode("s3cret-pass", "somesalt", iterations=1000)
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode("s3cret-pass", "somesalt", iterations=1000))
+        self.assertTrue(check_password("s3cret-pass", encoded))
+
+    def test_hashes_inline_without_workers(self):
+        with self.settings(PASSWORD_HASHING_WORKERS=0):
+            encoded = PooledPBKDF2PasswordHasher().encode("s3cret-pass", "somesalt", iterations=1000)
+        self.assertTrue(check_password("s3cret-pass", encoded))
+
+    def test_verification_goes_through_the_pool(self):
+        encoded = PBKDF2PasswordHasher().encode("s3cret-pass", "somesalt", iterations=1000)
+        with mock.patch("auth_account.hashers.submit_pbkdf2", wraps=hashers.submit_pbkdf2) as submit:
+            self.assertTrue(check_password("s3cret-pass", encoded))
+        submit.assert_called_once_with("sha256", b"s3cret-pass", b"somesalt", 1000)
+
+    def test_signup_and_login_hash_in_the_pool(self):
+        with self.settings(PASSWORD_HASHING_WORKERS=2):
+            signup = self.client.post(
+                reverse("user_signup"),
+                {
+                    "first_name": "Pool",
+                    "last_name": "User",
+                    "email": "pool@example.com",
+                    "password": "s3cret-pass",
+                    "confirm_password": "s3cret-pass",
+                },
+            )
+            with mock.patch("auth_account.hashers.submit_pbkdf2", wraps=hashers.submit_pbkdf2) as submit:
+                login = self.client.post(reverse("user_login"), {"username": "pool@example.com", "password": "s3cret-pass"})
+        self.assertEqual(signup.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(login.status_code, status.HTTP_200_OK)
+        self.assertEqual(submit.call_count, 1)
+        self.assertTrue(User.objects.get(email="pool@example.com").password.startswith("pbkdf2_sha256$"))
+
+
+"""
+Email Outbox
+"""
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP server that records the messages and connections it receives."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stand-in ready")
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250 stand-in")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                data = []
+                for data_line in self.rfile:
+                    if data_line.rstrip(b"\r\n") == b".":
+                        break
+                    data.append(data_line)
+                self.server.messages.append(b"".join(data))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class EmailOutboxTests(APITestCase):
+    def setUp(self):
+        self.smtp = SMTPStandIn()
+        self.addCleanup(self.smtp.stop)
+        self.smtp_settings = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=self.smtp.port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+        )
+
+    def queue(self, count):
+        for index in range(count):
+            Util.queue_email({"email_subject": f"Subject {index}", "email_body": "Body", "to_email": f"user{index}@example.com"})
+
+    def test_password_reset_request_only_queues_the_email(self):
+        create_teacher(1)
+        response = self.client.post(reverse("send_password_reset_email"), {"email": "teacher1@example.com"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().to_email, "teacher1@example.com")
+
+    def test_worker_drains_the_outbox_over_one_connection(self):
+        self.queue(3)
+        with self.smtp_settings:
+            call_command("send_queued_emails", stdout=StringIO())
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.SENT).count(), 3)
+
+    def test_failed_sends_back_off_and_then_give_up(self):
+        self.queue(1)
+        self.smtp.stop()
+        with self.smtp_settings:
+            self.assertEqual(Util.send_queued_emails(max_attempts=2, retry_delay=60), {"sent": 0, "retried": 1, "failed": 0})
+            # Not due again until the backoff has passed.
+            self.assertEqual(Util.send_queued_emails(max_attempts=2), {"sent": 0, "retried": 0, "failed": 0})
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(Util.send_queued_emails(max_attempts=2), {"sent": 0, "retried": 0, "failed": 1})
+        outbound = OutboundEmail.objects.get()
+        self.assertEqual(outbound.status, OutboundEmail.FAILED)
+        self.assertEqual(outbound.attempts, 2)
+        self.assertNotEqual(outbound.last_error, "")
+
+    def test_send_many_reuses_one_connection_and_reports_each_message(self):
+        messages = [{"email_subject": "Reset", "email_body": "Body", "to_email": f"user{index}@example.com"} for index in range(5)]
+        with self.smtp_settings:
+            report = Util.send_many(messages)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(report["sent"], 5)
+        self.assertEqual(report["failed"], 0)
+        self.assertEqual([result["to_email"] for result in report["results"]], [m["to_email"] for m in messages])
+        self.assertGreater(report["per_second"], 0)
+
+    def test_send_many_reports_every_message_when_the_server_is_down(self):
+        self.smtp.stop()
+        with self.smtp_settings:
+            report = Util.send_many([{"email_subject": "Reset", "email_body": "Body", "to_email": "user@example.com"}])
+        self.assertEqual(report["failed"], 1)
+        self.assertFalse(report["results"][0]["sent"])
+        self.assertIsNotNone(report["results"][0]["error"])
+
+
+"""
+Profile Creation
+"""
+
+
+class ProfileCreationTests(APITestCase):
+    def test_signup_creates_user_and_profile_in_one_transaction(self):
+        # SAVEPOINT, INSERT user, INSERT profile, RELEASE SAVEPOINT
+        with self.assertNumQueries(4):
+            user = create_teacher(1)
+        self.assertTrue(TeacherProfile.objects.filter(user=user).exists())
+        self.assertFalse(StudentProfile.objects.filter(user=user).exists())
+
+    def test_profile_is_rolled_back_with_the_user(self):
+        with mock.patch.object(TeacherProfile, "save", side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            create_teacher(1)
+        self.assertFalse(User.objects.exists())
+
+    def test_saving_a_user_does_not_resave_their_profile(self):
+        user = User.objects.get(pk=create_teacher(1).pk)
+        user.first_name = "Renamed"
+        with self.assertNumQueries(1):
+            user.save()
+        user.set_password("a-new-password")
+        with self.settings(PASSWORD_HASHING_WORKERS=0), self.assertNumQueries(1):
+            user.save()
+
+    def test_profile_update_endpoint_issues_a_single_update(self):
+        user = create_teacher(1)
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("profile"), {"bio": "Teaches Arabic"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"auth_account_customuser"', writes[0])
+
+
+class MeViewTests(APITestCase):
+    def test_returns_user_picture_and_profiles_in_one_query(self):
+        user = create_teacher(1, is_student=True)
+        ProfilePicture.objects.create(custom_user=user, image="profile/pictures/1.png")
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("me"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["email"], "teacher1@example.com")
+        self.assertEqual(response.data["profile_picture"]["user_first_name"], "First1")
+        self.assertEqual(response.data["student_profile"]["user"], user.pk)
+        self.assertEqual(response.data["teacher_profile"]["user"], user.pk)
+
+    def test_missing_relations_are_null(self):
+        user = User.objects.create_user(email="plain@example.com", username="plain@example.com")
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("me"))
+        self.assertIsNone(response.data["profile_picture"])
+        self.assertIsNone(response.data["student_profile"])
+        self.assertIsNone(response.data["teacher_profile"])
+
+
+"""
+Sparse Fieldsets
+"""
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_teacher(1)
+        ProfilePicture.objects.create(custom_user=self.user, image="profile/pictures/1.png")
+
+    def test_fields_prune_the_payload_and_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("all_teachers") + "?fields=id,user_first_name")
+        self.assertEqual(set(response.data["results"][0]), {"id", "user_first_name"})
+        select = [query["sql"] for query in queries if query["sql"].startswith("SELECT")][-1]
+        self.assertIn('"auth_account_customuser"."first_name"', select)
+        self.assertNotIn('"auth_account_customuser"."email"', select)
+        self.assertNotIn('"auth_account_teacherprofile"."qualifications"', select)
+
+    def test_fields_without_relations_drop_the_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("all_teacher_images") + "?fields=id,image")
+        self.assertEqual(set(response.data["results"][0]), {"id", "image"})
+        select = [query["sql"] for query in queries if query["sql"].startswith("SELECT")][-1]
+        self.assertNotIn("JOIN", select)
+
+    def test_exclude_drops_fields(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("profile") + "?exclude=bio,address,student_profile,teacher_profile")
+        self.assertEqual(set(response.data), {"first_name", "last_name", "email", "profile_picture"})
+
+    def test_nested_serializers_are_not_pruned(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("me") + "?fields=profile_picture")
+        self.assertEqual(set(response.data), {"profile_picture"})
+        self.assertIn("image", response.data["profile_picture"])
+
+    def test_fields_do_not_drop_writes(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse("profile") + "?fields=email", {"first_name": "Renamed"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["first_name"], "Renamed")
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Renamed")
+
+    def test_picture_urls_stay_media_paths(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("me") + "?fields=profile_picture")
+        self.assertEqual(response.data["profile_picture"]["image"], "/media/profile/pictures/1.png")
+
+    def test_teacher_profile_defers_unrequested_columns(self):
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("teacher_profile") + "?fields=id,subject")
+        self.assertEqual(set(response.data), {"id", "subject"})
+        self.assertNotIn("qualifications", queries[-1]["sql"])
+
+
+"""
+Fast Read Path
+"""
+
+
+class FastReadPathTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for index in range(3):
+            user = create_teacher(index)
+            ProfilePicture.objects.create(custom_user=user, image=f"profile/pictures/{index}.png")
+
+    def get_both(self, view, url):
+        cache.clear()
+        fast = self.client.get(url)
+        cache.clear()
+        with mock.patch.object(view, "fast_read_path", False):
+            slow = self.client.get(url)
+        return fast, slow
+
+    def test_fast_path_matches_the_serializers(self):
+        for view, name in [(AllTeachersView, "all_teachers"), (AllTeacherImagesView, "all_teacher_images")]:
+            for query in ["", "?page_size=2", "?fields=user_first_name"]:
+                fast, slow = self.get_both(view, reverse(name) + query)
+                self.assertEqual(fast.content, slow.content)
+        self.assertTrue(fast.json()["results"][0]["user_first_name"])
+
+    def test_image_urls_stay_media_paths(self):
+        response = self.client.get(reverse("all_teacher_images"))
+        self.assertEqual(response.json()["results"][0]["image"], "/media/profile/pictures/0.png")
+
+    def test_stdlib_fallback_renders_the_same_json(self):
+        data = {"results": [{"id": 1, "name": "Ünïcode", "score": None}]}
+        with mock.patch("auth_account.renderers.orjson", None):
+            fallback = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(fallback), data)
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), data)
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command("bench_serializers", rows=[10], stdout=out)
+        self.assertIn("10 rows", out.getvalue())
+
+
+class DirectoryExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for index in range(7):
+            create_teacher(index, is_student=True)
+        admin = User.objects.create_superuser(email="admin@example.com", username="admin@example.com")
+        self.client.force_authenticate(admin)
+
+    def test_exports_are_admin_only(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse("teachers_export")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_teachers_are_streamed_in_chunks_from_one_query(self):
+        with mock.patch.object(TeachersExportView, "chunk_size", 3):
+            response = self.client.get(reverse("teachers_export"))
+            self.assertTrue(response.streaming)
+            with self.assertNumQueries(1):
+                chunks = list(response.streaming_content)
+        # "[", three row chunks, "]"
+        self.assertEqual(len(chunks), 5)
+        teachers = json.loads(b"".join(chunks))
+        self.assertEqual(len(teachers), 7)
+        paginated = self.client.get(reverse("all_teachers")).json()["results"]
+        self.assertEqual(teachers, paginated)
+
+    def test_students_export_supports_fields(self):
+        response = self.client.get(reverse("students_export") + "?fields=user_email,teacher")
+        students = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(students), 7)
+        self.assertEqual(students[0], {"user_email": "teacher0@example.com", "teacher": None})
+
+    def test_empty_export_is_an_empty_array(self):
+        StudentProfile.objects.all().delete()
+        response = self.client.get(reverse("students_export"))
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
+
+
+
+"""
+Profile Pictures
+"""
+
+
+class ProfilePictureVariantTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_teacher(1)
+        self.client.force_authenticate(self.user)
+
+    def process_jobs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_image_jobs", stdout=StringIO())
+
+    def test_upload_is_queued_and_processed_by_worker(self):
+        response = self.client.post(reverse("profile_picture"), {"image": make_image()}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], ProfilePicture.PROCESSING)
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        self.assertEqual(picture.variants, {})
+        self.assertEqual(ImageJob.objects.get(picture=picture).status, ImageJob.PENDING)
+
+        self.process_jobs()
+        picture.refresh_from_db()
+        self.assertEqual(picture.status, ProfilePicture.READY)
+        self.assertEqual(ImageJob.objects.get(picture=picture).status, ImageJob.DONE)
+        self.assertEqual(set(picture.variants), {"64", "128", "512"})
+        for size, names in picture.variants.items():
+            self.assertEqual(set(names), {"webp", "jpeg"})
+            for extension, name in names.items():
+                with Image.open(picture.image.storage.path(name)) as variant:
+                    self.assertEqual(variant.size, (int(size), int(size)))
+                    self.assertEqual(variant.format, {"webp": "WEBP", "jpeg": "JPEG"}[extension])
+        data = self.client.get(reverse("me")).json()["profile_picture"]
+        self.assertTrue(data["image"].startswith("/media/profile/pictures/"))
+        self.assertTrue(data["variants"]["128"]["webp"].startswith("/media/profile/pictures/variants/"))
+
+    def test_worker_strips_exif_and_applies_orientation(self):
+        exif = Image.Exif()
+        exif[0x010F] = "PhoneMaker"
+        exif[0x0112] = 6  # rotate 90 degrees clockwise on display
+        buffer = BytesIO()
+        Image.new("RGB", (300, 200), (10, 120, 10)).save(buffer, "JPEG", exif=exif)
+        upload = SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+        self.client.post(reverse("profile_picture"), {"image": upload}, format="multipart")
+        raw_path = ProfilePicture.objects.get(custom_user=self.user).image.path
+        self.process_jobs()
+
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        with Image.open(picture.image.path) as original:
+            self.assertEqual(original.format, "JPEG")
+            self.assertEqual(original.size, (200, 300))
+            self.assertEqual(len(original.getexif()), 0)
+        self.assertNotEqual(picture.image.path, raw_path)
+        self.assertEqual(picture_storage.references(os.path.relpath(raw_path, picture_storage.location)), 0)
+
+    def test_failed_job_is_retried_then_marks_picture_failed(self):
+        self.client.post(reverse("profile_picture"), {"image": make_image()}, format="multipart")
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        with open(picture.image.path, "wb") as image_file:
+            image_file.write(b"not an image any more")
+
+        self.process_jobs()
+        job = ImageJob.objects.get(picture=picture)
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 1))
+        self.assertIn("UnidentifiedImageError", job.last_error)
+
+        for _ in range(2):
+            ImageJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+            self.process_jobs()
+        job.refresh_from_db()
+        picture.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 3))
+        self.assertEqual(picture.status, ProfilePicture.FAILED)
+
+    def test_failed_attempt_releases_the_files_it_stored(self):
+        self.client.post(reverse("profile_picture"), {"image": make_image()}, format="multipart")
+        blobs = set(MediaBlob.objects.values_list("name", "references"))
+        files = set(images.iter_stored_files(picture_storage, "profile"))
+
+        def render_variants(image_file):
+            yield 64, "webp", b"first variant"
+            raise OSError("No space left on device")
+
+        with mock.patch("auth_account.images.render_variants", render_variants):
+            self.process_jobs()
+        job = ImageJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ImageJob.PENDING, 1))
+        self.assertEqual(set(MediaBlob.objects.values_list("name", "references")), blobs)
+        left_behind = set(images.iter_stored_files(picture_storage, "profile")) - files
+        self.assertFalse(MediaBlob.objects.filter(name__in=left_behind).exists())
+
+    def test_listing_exposes_variant_urls(self):
+        self.client.post(reverse("profile_picture"), {"image": make_image()}, format="multipart")
+        self.process_jobs()
+        picture = self.client.get(reverse("all_teacher_images")).json()["results"][0]
+        self.assertEqual(picture["status"], ProfilePicture.READY)
+        self.assertEqual(set(picture["variants"]), {"64", "128", "512"})
+        self.assertTrue(picture["variants"]["64"]["jpeg"].endswith(".jpeg"))
+
+
+class ContentAddressedStorageTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_identical_uploads_are_stored_once(self):
+        first = create_teacher(1)
+        second = create_teacher(2)
+        for user in (first, second):
+            self.client.force_authenticate(user)
+            self.client.post(reverse("profile_picture"), {"image": make_image(name="gray.png")}, format="multipart")
+
+        names = [ProfilePicture.objects.get(custom_user=user).image.name for user in (first, second)]
+        self.assertEqual(names[0], names[1])
+        self.assertRegex(names[0], r"^profile/pictures/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        self.assertTrue(picture_storage.is_immutable(names[0]))
+        self.assertEqual(picture_storage.references(names[0]), 2)
+        self.assertEqual(os.listdir(os.path.dirname(picture_storage.path(names[0]))), [os.path.basename(names[0])])
+
+    def test_last_reference_drops_the_blob_and_leaves_the_file_to_the_collector(self):
+        name = picture_storage.save("profile/pictures/a.png", make_image())
+        self.assertEqual(picture_storage.save("profile/pictures/b.png", make_image()), name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            picture_storage.delete(name)
+        self.assertTrue(picture_storage.exists(name))
+        self.assertEqual(picture_storage.references(name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            picture_storage.delete(name)
+        self.assertTrue(picture_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_reusing_a_released_file_keeps_it_from_the_collector(self):
+        name = picture_storage.save("profile/pictures/a.png", make_image())
+        picture_storage.delete(name)
+        past = time.time() - 7200
+        os.utime(picture_storage.path(name), (past, past))
+
+        self.assertEqual(picture_storage.save("profile/pictures/b.png", make_image()), name)
+        call_command("collect_orphaned_media", stdout=StringIO())
+        self.assertTrue(picture_storage.exists(name))
+        self.assertEqual(picture_storage.references(name), 1)
+
+    def test_legacy_names_are_not_immutable(self):
+        self.assertFalse(picture_storage.is_immutable("profile/pictures/gray_G9yEnFF.png"))
+
+
+
+class OrphanedMediaTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_teacher(1)
+        self.client.force_authenticate(self.user)
+
+    def upload(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("profile_picture"), {"image": make_image(**kwargs)}, format="multipart")
+            call_command("process_image_jobs", stdout=StringIO())
+        return ProfilePicture.objects.get(custom_user=self.user)
+
+    def age(self, *names):
+        past = time.time() - 7200
+        for name in names:
+            os.utime(picture_storage.path(name), (past, past))
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command("collect_orphaned_media", *args, stdout=out)
+        return out.getvalue()
+
+    def test_replacing_a_picture_releases_its_files_to_the_collector(self):
+        old = self.upload(color=(200, 30, 30))
+        old_names = ProfilePicture.stored_names(old.image.name, old.variants)
+        new = self.upload(color=(30, 30, 200))
+        new_names = ProfilePicture.stored_names(new.image.name, new.variants)
+        self.assertFalse(MediaBlob.objects.filter(name__in=old_names).exists())
+        self.age(*old_names, *new_names)
+        self.collect()
+        for name in old_names:
+            self.assertFalse(picture_storage.exists(name), name)
+        for name in new_names:
+            self.assertTrue(picture_storage.exists(name), name)
+
+    @override_settings(PROFILE_PICTURE_DELETE_FILES=False)
+    def test_collector_removes_only_old_unreferenced_files(self):
+        old = self.upload(color=(200, 30, 30))
+        old_names = ProfilePicture.stored_names(old.image.name, old.variants)
+        new = self.upload(color=(30, 30, 200))
+        kept = ProfilePicture.stored_names(new.image.name, new.variants)
+        legacy = "profile/pictures/gray_G9yEnFF.png"
+        os.makedirs(os.path.dirname(picture_storage.path(legacy)), exist_ok=True)
+        with open(picture_storage.path(legacy), "wb") as legacy_file:
+            legacy_file.write(b"legacy")
+        # Includes the raw uploads that processing released.
+        stored = list(images.iter_stored_files(picture_storage, "profile/pictures"))
+        orphans = set(stored) - set(kept)
+        self.assertTrue(set(old_names) | {legacy} <= orphans)
+        self.age(*stored)
+        fresh = picture_storage.save("profile/pictures/fresh.png", make_image(size=(10, 10)))
+
+        output = self.collect("--dry-run")
+        self.assertIn(f"{len(orphans)} orphans", output)
+        self.assertIn("skipped 1 recent", output)
+        self.assertTrue(all(picture_storage.exists(name) for name in old_names))
+
+        output = self.collect()
+        self.assertIn(f"deleted {len(orphans)}", output)
+        for name in orphans:
+            self.assertFalse(picture_storage.exists(name), name)
+        for name in [*kept, fresh]:
+            self.assertTrue(picture_storage.exists(name), name)
+        self.assertFalse(MediaBlob.objects.filter(name__in=old_names).exists())
+
+
+class MediaViewTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.name = picture_storage.save("profile/pictures/avatar.png", make_image(size=(64, 64)))
+        with open(picture_storage.path(self.name), "rb") as stored:
+            self.content = stored.read()
+        self.url = f"/media/{self.name}"
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_serves_whole_file_with_immutable_caching_for_hashed_names(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+        legacy = "profile/pictures/gray.png"
+        with open(picture_storage.path(legacy), "wb") as legacy_file:
+            legacy_file.write(b"legacy")
+        self.assertEqual(self.client.get(f"/media/{legacy}")["Cache-Control"], "public, max-age=3600")
+
+    def test_compressed_files_are_not_served_as_encoded(self):
+        for name, content_type in [("export.json.gz", "application/gzip"), ("export.tar.bz2", "application/x-bzip")]:
+            with open(os.path.join(self.media_root, name), "wb") as stored:
+                stored.write(b"compressed")
+            response = self.client.get(f"/media/{name}")
+            self.assertEqual(response["Content-Type"], content_type)
+            self.assertNotIn("Content-Encoding", response)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(self.body(response), self.content[10:20])
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(self.body(response), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+        stale = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(stale.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.body(stale), self.content)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_sendfile_delegation(self):
+        with self.settings(MEDIA_SENDFILE="x-accel-redirect"):
+            response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.name}")
+        self.assertEqual(response.content, b"")
+        with self.settings(MEDIA_SENDFILE="x-sendfile"):
+            response = self.client.get(self.url)
+        self.assertEqual(response["X-Sendfile"], picture_storage.path(self.name))
+
+    def test_missing_and_escaping_paths_are_not_found(self):
+        self.assertEqual(self.client.get("/media/profile/pictures/missing.png").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/media/../manage.py").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/media/profile/pictures").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChunkedUploadTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_teacher(1)
+        self.client.force_authenticate(self.user)
+        self.content = make_image(size=(300, 200)).read()
+
+    def start(self, content=None, **overrides):
+        content = self.content if content is None else content
+        data = {"filename": "avatar.png", "size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+        data.update(overrides)
+        return self.client.post(reverse("chunked_upload"), data, format="json")
+
+    def put_chunk(self, upload_id, offset, chunk):
+        url = reverse("chunked_upload_detail", args=[upload_id]) + f"?offset={offset}"
+        return self.client.put(url, chunk, content_type="application/octet-stream")
+
+    def finalize(self, upload_id):
+        return self.client.post(reverse("chunked_upload_finalize", args=[upload_id]))
+
+    def test_chunks_are_resumed_and_finalized_into_a_profile_picture(self):
+        upload_id = self.start().data["id"]
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[:100]).data["offset"], 100)
+
+        # A retried chunk at a stale offset is rejected with the offset to resume from.
+        response = self.put_chunk(upload_id, 0, self.content[:100])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["offset"], 100)
+        self.assertEqual(self.client.get(reverse("chunked_upload_detail", args=[upload_id])).data["offset"], 100)
+
+        self.assertEqual(self.finalize(upload_id).status_code, status.HTTP_409_CONFLICT)
+        self.put_chunk(upload_id, 100, self.content[100:])
+        upload_path = ChunkedUpload.objects.get(id=upload_id).path
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], ProfilePicture.PROCESSING)
+
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        with picture.image.open("rb") as image_file:
+            self.assertEqual(image_file.read(), self.content)
+        self.assertTrue(ImageJob.objects.filter(picture=picture).exists())
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload_id).exists())
+        self.assertFalse(os.path.exists(upload_path))
+
+    def test_checksum_mismatch_discards_the_upload(self):
+        upload_id = self.start(sha256="0" * 64).data["id"]
+        self.put_chunk(upload_id, 0, self.content)
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload_id).exists())
+        self.assertFalse(ProfilePicture.objects.filter(custom_user=self.user).exists())
+
+    def test_chunks_cannot_overrun_the_declared_size(self):
+        upload_id = self.start().data["id"]
+        response = self.put_chunk(upload_id, 0, self.content + b"extra")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        upload = ChunkedUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.offset, 0)
+        self.assertEqual(os.path.getsize(upload.path), 0)
+
+    def test_chunk_body_is_read_without_a_transaction_and_offsets_advance_conditionally(self):
+        upload_id = self.start().data["id"]
+        depth = len(connection.atomic_blocks)
+        seen = []
+
+        class Body(BytesIO):
+            def read(body, size=-1):
+                if not seen:
+                    seen.append(len(connection.atomic_blocks))
+                    # Another writer advances the offset meanwhile.
+                    ChunkedUpload.objects.filter(id=upload_id).update(offset=50)
+                return super().read(size)
+
+        with mock.patch.object(Request, "stream", property(lambda request: Body(self.content[:100]))):
+            response = self.put_chunk(upload_id, 0, self.content[:100])
+        self.assertEqual(seen, [depth])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["offset"], 50)
+        self.assertEqual(os.path.getsize(ChunkedUpload.objects.get(id=upload_id).path), 0)
+
+    def test_concurrent_chunks_for_one_upload_are_refused(self):
+        upload = ChunkedUpload.objects.get(id=self.start().data["id"])
+        with open(upload.path, "r+b") as part:
+            locks.lock(part, locks.LOCK_EX)
+            try:
+                response = self.put_chunk(upload.id, 0, self.content[:100])
+            finally:
+                locks.unlock(part)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.put_chunk(upload.id, 0, self.content[:100]).data["offset"], 100)
+
+    @override_settings(CHUNKED_UPLOAD_MAX_OPEN=2)
+    def test_open_uploads_per_user_are_capped(self):
+        first, _ = self.start().data["id"], self.start()
+        response = self.start()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(ChunkedUpload.objects.filter(user=self.user).count(), 2)
+
+        self.client.delete(reverse("chunked_upload_detail", args=[first]))
+        self.assertEqual(self.start().status_code, status.HTTP_201_CREATED)
+        ChunkedUpload.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.start().status_code, status.HTTP_201_CREATED)
+
+    def test_uploads_are_private(self):
+        self.assertEqual(self.start(size=0).status_code, status.HTTP_400_BAD_REQUEST)
+        upload = ChunkedUpload.objects.get(id=self.start(filename="../../evil.png").data["id"])
+        self.assertEqual(upload.filename, "evil.png")
+        relative = os.path.relpath(upload.path, self.media_root)
+        self.assertEqual(self.client.get(f"/media/{relative}").status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(create_teacher(2))
+        self.assertEqual(self.put_chunk(upload.id, 0, b"x").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_collector_expires_abandoned_uploads(self):
+        upload = ChunkedUpload.objects.get(id=self.start().data["id"])
+        ChunkedUpload.objects.filter(id=upload.id).update(updated_at=timezone.now() - timedelta(days=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("collect_orphaned_media", stdout=StringIO())
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
+        self.assertFalse(os.path.exists(upload.path))
+
+
+class ProfilePictureReplaceTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_teacher(1)
+        self.client.force_authenticate(self.user)
+
+    def upload(self, color):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("profile_picture"), {"image": make_image(color=color)}, format="multipart")
+
+    def test_replace_keeps_the_row_and_releases_the_old_file(self):
+        first = self.upload((200, 30, 30))
+        old_name = ProfilePicture.objects.get(custom_user=self.user).image.name
+        with CaptureQueriesContext(connection) as queries:
+            second = self.upload((30, 30, 200))
+        self.assertEqual(second.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.data["id"], second.data["id"])
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if query["sql"].startswith('DELETE FROM "auth_account_profilepicture"')
+        ])
+
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        self.assertNotEqual(picture.image.name, old_name)
+        self.assertEqual(picture_storage.references(old_name), 0)
+        self.assertEqual(ImageJob.objects.filter(picture=picture, status=ImageJob.PENDING).count(), 2)
+
+    def test_profile_update_replaces_through_the_same_path(self):
+        first = self.upload((200, 30, 30))
+        old_name = ProfilePicture.objects.get(custom_user=self.user).image.name
+        serializer = UserProfileSerializer(
+            self.user, data={"profile_picture": {"image": make_image(color=(30, 200, 30))}}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        self.assertEqual(picture.id, first.data["id"])
+        self.assertEqual(picture.status, ProfilePicture.PROCESSING)
+        self.assertNotEqual(picture.image.name, old_name)
+        self.assertEqual(picture_storage.references(old_name), 0)
+        self.assertEqual(ImageJob.objects.filter(picture=picture).count(), 2)
+
+    def test_invalid_upload_leaves_the_current_picture_alone(self):
+        self.upload((200, 30, 30))
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        upload = SimpleUploadedFile("avatar.png", b"not an image", content_type="image/png")
+        response = self.client.post(reverse("profile_picture"), {"image": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ProfilePicture.objects.get(custom_user=self.user).image.name, picture.image.name)
+
+    def test_job_for_a_replaced_upload_does_not_overwrite_the_newer_image(self):
+        self.upload((200, 30, 30))
+        render = images.generate_variants
+
+        def replace_while_rendering(picture):
+            # A new upload lands while the worker is busy with the old one.
+            variants = render(picture)
+            self.upload((30, 30, 200))
+            return variants
+
+        with mock.patch("auth_account.images.generate_variants", side_effect=replace_while_rendering):
+            with self.captureOnCommitCallbacks(execute=True):
+                images.process_image_jobs(batch_size=1)
+        picture = ProfilePicture.objects.get(custom_user=self.user)
+        self.assertEqual(picture.status, ProfilePicture.PROCESSING)
+        self.assertEqual(picture.variants, {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("process_image_jobs", stdout=StringIO())
+        picture.refresh_from_db()
+        self.assertEqual(picture.status, ProfilePicture.READY)
+        with Image.open(picture.image.path) as image:
+            self.assertEqual(image.getpixel((0, 0))[:3], (30, 30, 200))
+        self.assertEqual(
+            set(MediaBlob.objects.values_list("name", flat=True)),
+            set(ProfilePicture.stored_names(picture.image.name, picture.variants)),
+        )
+
+
+class ConcurrentProfilePictureReplaceTests(TemporaryMediaMixin, TransactionTestCase):
+    # Uploads are serialized by the row lock, or on SQLite by the write lock
+    # IMMEDIATE transactions take at BEGIN (Django 5.1+).
+    @skipUnless(
+        connection.features.has_select_for_update
+        or connection.settings_dict["OPTIONS"].get("transaction_mode") == "IMMEDIATE",
+        "Concurrent writers are not serialized",
+    )
+    def test_concurrent_uploads_leave_one_picture_row(self):
+        user = create_teacher(1)
+        uploads = 4
+        barrier = threading.Barrier(uploads)
+        responses = []
+
+        def upload(index):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                responses.append(client.post(
+                    reverse("profile_picture"),
+                    {"image": make_image(color=(index * 40, 30, 30))},
+                    format="multipart",
+                ))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=upload, args=(index,)) for index in range(uploads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_202_ACCEPTED] * uploads)
+        self.assertEqual(len({response.data["id"] for response in responses}), 1)
+        self.assertEqual(ProfilePicture.objects.filter(custom_user=user).count(), 1)
+        self.assertEqual(ImageJob.objects.count(), uploads)
+        # Every replaced upload was released exactly once.
+        picture = ProfilePicture.objects.get(custom_user=user)
+        self.assertEqual(list(MediaBlob.objects.values_list("name", "references")), [(picture.image.name, 1)])
@@ -7,12 +7,19 @@ from .views import (
     SendPasswordResetEmailView,
     LogoutView,
     UserProfileView,
+    MeView,
     ProfilePictureView,
+    ChunkedUploadView,
+    ChunkedUploadDetailView,
+    ChunkedUploadFinalizeView,
     TokenValidationView,
     StudentProfileView,
     TeacherProfileView,
     AllTeachersView,
     AllTeacherImagesView,
+    DirectoryCacheStatsView,
+    TeachersExportView,
+    StudentsExportView,
 )
 from django.conf.urls.static import static
 from django.conf import settings
@@ -37,12 +44,23 @@ urlpatterns = [
         name="send_password_reset_email",
     ),
     path("profile/", UserProfileView.as_view(), name="profile"),
+    path("me/", MeView.as_view(), name="me"),
     path("profile/picture/", ProfilePictureView.as_view(), name="profile_picture"),
+    path("profile/picture/uploads/", ChunkedUploadView.as_view(), name="chunked_upload"),
+    path("profile/picture/uploads/<uuid:upload_id>/", ChunkedUploadDetailView.as_view(), name="chunked_upload_detail"),
+    path(
+        "profile/picture/uploads/<uuid:upload_id>/finalize/",
+        ChunkedUploadFinalizeView.as_view(),
+        name="chunked_upload_finalize",
+    ),
     path("validate/token/", TokenValidationView.as_view(), name="validate_token"),
     path("student/profile/", StudentProfileView.as_view(), name="student_profile"),
     path("teacher/profile/", TeacherProfileView.as_view(), name="teacher_profile"),
     path("teachers/", AllTeachersView.as_view(), name="all_teachers"),
     path("teacher-images/", AllTeacherImagesView.as_view(), name="all_teacher_images"),
+    path("teachers/export/", TeachersExportView.as_view(), name="teachers_export"),
+    path("students/export/", StudentsExportView.as_view(), name="students_export"),
+    path("cache/stats/", DirectoryCacheStatsView.as_view(), name="directory_cache_stats"),
 ]
 
 if settings.DEBUG:
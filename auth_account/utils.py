@@ -1,8 +1,134 @@
-from django.core.mail import EmailMessage
+from datetime import timedelta
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
 import os
+import time
+import uuid
+from .models import OutboundEmail
 
 class Util:
     @staticmethod
     def send_email(data):
         email = EmailMessage(subject=data['email_subject'], body=data['email_body'],from_email=os.environ.get("EMAIL_FROM"), to=[data['to_email']] )
-        email.send()
\ No newline at end of file
+        email.send()
+
+    @staticmethod
+    def send_many(messages, connection=None):
+        """
+        Sends a list of `send_email` style dicts over one SMTP connection that is
+        opened and authenticated once, and returns per-message results plus
+        throughput:
+
+            {"results": [{"to_email": ..., "sent": True, "error": None}, ...],
+             "sent": 2, "failed": 0, "elapsed": 0.031, "per_second": 64.5}
+
+        A message may carry its own "from_email"; otherwise EMAIL_FROM is used.
+        If the connection cannot be opened every message is reported as failed
+        with that error.
+        """
+        started = time.perf_counter()
+        results = []
+        connection = connection or get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            results = [{"to_email": data['to_email'], "sent": False, "error": repr(error)} for data in messages]
+        else:
+            try:
+                for data in messages:
+                    email = EmailMessage(
+                        subject=data['email_subject'],
+                        body=data['email_body'],
+                        from_email=data.get('from_email') or os.environ.get("EMAIL_FROM"),
+                        to=[data['to_email']],
+                        connection=connection,
+                    )
+                    try:
+                        email.send()
+                    except Exception as error:
+                        results.append({"to_email": data['to_email'], "sent": False, "error": repr(error)})
+                    else:
+                        results.append({"to_email": data['to_email'], "sent": True, "error": None})
+            finally:
+                connection.close()
+
+        elapsed = time.perf_counter() - started
+        sent = sum(1 for result in results if result["sent"])
+        return {
+            "results": results,
+            "sent": sent,
+            "failed": len(results) - sent,
+            "elapsed": elapsed,
+            "per_second": sent / elapsed if elapsed else 0.0,
+        }
+
+    @staticmethod
+    def queue_email(data):
+        """Stores the email in the outbox; the `send_queued_emails` worker delivers it."""
+        return OutboundEmail.objects.create(
+            subject=data['email_subject'],
+            body=data['email_body'],
+            from_email=os.environ.get("EMAIL_FROM") or "",
+            to_email=data['to_email'],
+        )
+
+    @staticmethod
+    def send_queued_emails(batch_size=50, max_attempts=5, retry_delay=60, lease=300):
+        """
+        Sends one batch of due outbox emails over a single SMTP connection and
+        returns a dict of sent/retried/failed counts.
+
+        Rows are claimed by pushing their `next_attempt_at` forward by `lease`
+        seconds under a claim token, so concurrent workers never send the same
+        row and rows held by a worker that died become due again. Failed sends
+        are retried after `retry_delay * 2 ** (attempts - 1)` seconds and given
+        up on after `max_attempts`.
+        """
+        now = timezone.now()
+        due = OutboundEmail.objects.filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+        ids = list(due.order_by("next_attempt_at", "id").values_list("id", flat=True)[:batch_size])
+        token = uuid.uuid4().hex
+        due.filter(id__in=ids).update(claim_token=token, next_attempt_at=now + timedelta(seconds=lease))
+        batch = list(OutboundEmail.objects.filter(id__in=ids, claim_token=token).order_by("id"))
+
+        results = {"sent": 0, "retried": 0, "failed": 0}
+        if not batch:
+            return results
+
+        report = Util.send_many([
+            {
+                "email_subject": outbound.subject,
+                "email_body": outbound.body,
+                "from_email": outbound.from_email,
+                "to_email": outbound.to_email,
+            }
+            for outbound in batch
+        ])
+        for outbound, result in zip(batch, report["results"]):
+            if result["sent"]:
+                OutboundEmail.objects.filter(id=outbound.id).update(
+                    status=OutboundEmail.SENT,
+                    attempts=F("attempts") + 1,
+                    sent_at=timezone.now(),
+                    last_error="",
+                )
+                results["sent"] += 1
+            else:
+                results[Util._record_email_failure(outbound, result["error"], max_attempts, retry_delay)] += 1
+        return results
+
+    @staticmethod
+    def _record_email_failure(outbound, error, max_attempts, retry_delay):
+        attempts = outbound.attempts + 1
+        if attempts >= max_attempts:
+            status, outcome = OutboundEmail.FAILED, "failed"
+        else:
+            status, outcome = OutboundEmail.PENDING, "retried"
+        OutboundEmail.objects.filter(id=outbound.id).update(
+            status=status,
+            attempts=attempts,
+            next_attempt_at=timezone.now() + timedelta(seconds=retry_delay * 2 ** (attempts - 1)),
+            last_error=error,
+        )
+        return outcome
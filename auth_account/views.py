@@ -1,12 +1,25 @@
+import hashlib
+import os
+from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth import authenticate, logout
+from django.core.files import File, locks
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
 from rest_framework import status, viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated, DjangoModelPermissionsOrAnonReadOnly
-from rest_framework_simplejwt.tokens import RefreshToken
-from .models import CustomUser as User, ProfilePicture, StudentProfile, TeacherProfile
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated, DjangoModelPermissionsOrAnonReadOnly
+from .authentication import RefreshToken, StatelessJWTAuthentication, token_revocations
+from .images import replace_picture
+from .models import ChunkedUpload, CustomUser as User, ProfilePicture, StudentProfile, TeacherProfile
+from .cache import DirectoryCacheMixin, get_directory_cache_stats
+from .pagination import DirectoryCursorPagination
+from .renderers import FastJSONRenderer, iter_json_array
 from .serializers import (
     UserSerializer,
     UserProfileSerializer,
@@ -17,6 +30,9 @@ from .serializers import (
     StudentProfileSerializer,
     TeacherProfileSerializer,
     TeacherCardSerializer,
+    StudentCardSerializer,
+    MeSerializer,
+    ChunkedUploadSerializer,
 )
 
 """
@@ -30,6 +46,7 @@ def get_tokens_for_user(user):
     }
 
 class TokenValidationView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -81,6 +98,8 @@ class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
+        if request.auth is not None:
+            token_revocations.revoke_token(request.auth)
         logout(request)
         return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
 
@@ -89,47 +108,192 @@ class UserProfileView(APIView):
 
     def get(self, request, format=None):
         user = request.user
-        serializer = UserProfileSerializer(user)
+        serializer = UserProfileSerializer(user, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, format=None):
         user = request.user
-        serializer = UserProfileSerializer(user, data=request.data, partial=True)
+        serializer = UserProfileSerializer(user, data=request.data, partial=True, context={"request": request})
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class MeView(APIView):
+    """
+    The user, their profile picture and their student and teacher profiles in
+    one payload, loaded with a single joined query.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        user = User.objects.select_related(
+            "profile_picture", "student_profile", "teacher_profile"
+        ).get(pk=request.user.pk)
+        serializer = MeSerializer(user, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+def save_profile_picture(request, image_data):
+    """
+    Validates `image_data` and makes it the user's picture (see
+    `images.replace_picture`).
+    """
+    serializer = ProfilePictureSerializer(data={"image": image_data}, context={"request": request})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    serializer.instance = replace_picture(request.user, serializer.validated_data["image"])
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
 class ProfilePictureView(APIView):
     queryset = ProfilePicture.objects.all()
     permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
 
     def post(self, request, format=None):
-        user = request.user
         image_data = request.data.get("image")
 
         if image_data is None:
             return Response(
                 {"error": "Image data is required."}, status=status.HTTP_400_BAD_REQUEST
             )
+        return save_profile_picture(request, image_data)
 
+
+"""
+Resumable Profile Picture Uploads
+
+POST uploads/ with filename, size and sha256 starts an upload. Each chunk is
+PUT to uploads/<id>/?offset=<bytes received so far> as the raw request body
+and written straight to disk; a GET tells a reconnecting client where to
+resume. POST uploads/<id>/finalize/ checks the sha256 and saves the file as
+the user's profile picture the same way a single-request upload is.
+"""
+
+class ChunkedUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = ChunkedUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Every open upload reserves up to CHUNKED_UPLOAD_MAX_SIZE on disk
+        # until it expires.
+        max_open = getattr(settings, "CHUNKED_UPLOAD_MAX_OPEN", 3)
+        expiry = getattr(settings, "CHUNKED_UPLOAD_EXPIRY", 24 * 60 * 60)
+        open_uploads = ChunkedUpload.objects.filter(
+            user=request.user, updated_at__gte=timezone.now() - timedelta(seconds=expiry)
+        )
+        if open_uploads.count() >= max_open:
+            return Response(
+                {"error": f"At most {max_open} uploads can be open at once; finish or delete one first."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+        upload = serializer.save(user=request.user)
+        os.makedirs(os.path.dirname(upload.path), exist_ok=True)
+        open(upload.path, "wb").close()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class ChunkedUploadDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+    block_size = 64 * 1024
+
+    def get(self, request, upload_id, format=None):
+        upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+        return Response(ChunkedUploadSerializer(upload).data)
+
+    def put(self, request, upload_id, format=None):
+        try:
+            offset = int(request.query_params["offset"])
+        except (KeyError, ValueError):
+            return Response({"error": "An integer offset is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # No transaction is held while the body arrives: a slow client would
+        # otherwise keep the row (and, with SQLite's IMMEDIATE transactions,
+        # the whole database) locked. A file lock keeps one writer per upload
+        # and a conditional UPDATE advances the offset.
+        upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
         try:
-            # Check if the user already has a profile picture
-            existing_profile_picture = ProfilePicture.objects.get(custom_user=user)
-            # Delete the existing profile picture
-            existing_profile_picture.delete()
-        except ProfilePicture.DoesNotExist:
-            pass  # If the user doesn't have a profile picture, do nothing
-        
-        # Save the new profile picture
-        profile_picture_data = {"custom_user": user.id, "image": image_data}
-        serializer = ProfilePictureSerializer(data=profile_picture_data)
+            part = open(upload.path, "r+b")
+        except FileNotFoundError:
+            # Deleted or expired since the lookup.
+            return Response({"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND)
+        with part:
+            if not locks.lock(part, locks.LOCK_EX | locks.LOCK_NB):
+                return Response(
+                    {"error": "Another chunk is being written.", "offset": upload.offset},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                # Re-read under the lock: a chunk may have finished since.
+                upload.refresh_from_db(fields=["offset"])
+                if offset != upload.offset:
+                    # The client lost track, e.g. after a dropped connection;
+                    # it resumes from the offset we report.
+                    return Response({"error": "Offset mismatch.", "offset": upload.offset}, status=status.HTTP_409_CONFLICT)
+                return self.write_chunk(request, upload, part, offset)
+            finally:
+                locks.unlock(part)
+
+    def write_chunk(self, request, upload, part, offset):
+        max_chunk = getattr(settings, "CHUNKED_UPLOAD_MAX_CHUNK_SIZE", 5 * 1024 * 1024)
+        limit = min(upload.size - offset, max_chunk)
+        written = 0
+        # Read the body from the stream rather than request.data so the
+        # chunk is never buffered whole in memory.
+        stream = request.stream
+        part.seek(offset)
+        while stream is not None:
+            block = stream.read(self.block_size)
+            if not block:
+                break
+            written += len(block)
+            if written > limit:
+                part.truncate(offset)
+                return Response(
+                    {"error": f"Chunk exceeds the {limit} bytes allowed at this offset.", "offset": offset},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+            part.write(block)
+        part.truncate(offset + written)
+        if not written:
+            return Response({"error": "Chunk is empty.", "offset": offset}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated_at = timezone.now()
+        advanced = ChunkedUpload.objects.filter(id=upload.id, user=request.user, offset=offset).update(
+            offset=offset + written, updated_at=updated_at
+        )
+        if not advanced:
+            part.truncate(offset)
+            current = ChunkedUpload.objects.filter(id=upload.id).values_list("offset", flat=True).first()
+            return Response({"error": "Offset mismatch.", "offset": current}, status=status.HTTP_409_CONFLICT)
+        upload.offset, upload.updated_at = offset + written, updated_at
+        return Response(ChunkedUploadSerializer(upload).data)
+
+    def delete(self, request, upload_id, format=None):
+        get_object_or_404(ChunkedUpload, id=upload_id, user=request.user).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class ChunkedUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]
 
-        if serializer.is_valid():
-            serializer.validated_data["custom_user_id"] = user.id
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    def post(self, request, upload_id, format=None):
+        upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+        if upload.offset != upload.size:
+            return Response(
+                {"error": "Upload is incomplete.", "offset": upload.offset}, status=status.HTTP_409_CONFLICT
+            )
+
+        digest = hashlib.sha256()
+        with open(upload.path, "rb") as part:
+            for block in iter(lambda: part.read(1024 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != upload.sha256:
+            upload.delete()
+            return Response({"error": "Checksum mismatch; start a new upload."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with open(upload.path, "rb") as part:
+            response = save_profile_picture(request, File(part, name=upload.filename))
+        if response.status_code == status.HTTP_202_ACCEPTED:
+            upload.delete()
+        return response
 
 class CustomPasswordResetView(APIView):
     permission_classes = [IsAuthenticated]
@@ -186,9 +350,10 @@ class StudentProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        student_profile = StudentProfile.objects.filter(user=request.user).first()
+        student_profiles = StudentProfileSerializer.prune_queryset(StudentProfile.objects.filter(user=request.user), request)
+        student_profile = student_profiles.first()
         if student_profile:
-            serializer = StudentProfileSerializer(student_profile)
+            serializer = StudentProfileSerializer(student_profile, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response({"error": "Student profile not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -213,9 +378,10 @@ class TeacherProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        teacher_profile = TeacherProfile.objects.filter(user=request.user).first()
+        teacher_profiles = TeacherProfileSerializer.prune_queryset(TeacherProfile.objects.filter(user=request.user), request)
+        teacher_profile = teacher_profiles.first()
         if teacher_profile:
-            serializer = TeacherProfileSerializer(teacher_profile)
+            serializer = TeacherProfileSerializer(teacher_profile, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response({"error": "Teacher profile not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -236,19 +402,104 @@ class TeacherProfileView(APIView):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-class AllTeachersView(APIView):
+"""
+Public Directory Views
+
+Both listings are public and hit on every landing-page view, so each page is
+served from a single joined SELECT that only projects the columns the card
+serializers read. `query_budget` is the number of queries a request is allowed
+to make on a cache miss and is enforced by the tests. Results are cursor
+paginated on `id` and whole pages are cached until a teacher, user or picture
+changes. `?fields=`/`?exclude=` narrow both the payload and the SELECT.
+"""
+class DirectoryListView(DirectoryCacheMixin, APIView):
+    """
+    Base for the public listings. With `fast_read_path` the page is read as a
+    values() projection of `serializer_class` and encoded by FastJSONRenderer
+    instead of building model instances and running the serializer per row;
+    the payload is the same either way.
+    """
     permission_classes = [AllowAny]
+    pagination_class = DirectoryCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    serializer_class = None
+    fast_read_path = True
+    query_budget = 1
+
+    def build_data(self, request):
+        paginator = self.pagination_class()
+        queryset = self.serializer_class.prune_queryset(self.get_queryset(), request)
+        if self.fast_read_path:
+            queryset = self.serializer_class.values_queryset(queryset, request)
+            rows = paginator.paginate_queryset(queryset, request, view=self)
+            data = self.serializer_class.values_rows(rows, request)
+        else:
+            objects = paginator.paginate_queryset(queryset, request, view=self)
+            data = self.serializer_class(objects, many=True, context={"request": request}).data
+        return paginator.get_paginated_response(data).data
+
+
+class AllTeachersView(DirectoryListView):
+    serializer_class = TeacherCardSerializer
+
+    def get_queryset(self):
+        return TeacherProfile.objects.cards()
+
+
+class AllTeacherImagesView(DirectoryListView):
+    serializer_class = ProfilePictureSerializer
+
+    def get_queryset(self):
+        return ProfilePicture.objects.select_related("custom_user").only(
+            "id",
+            "image",
+            "variants",
+            "status",
+            "custom_user__first_name",
+            "custom_user__last_name",
+        )
+
+
+"""
+Directory Exports
+
+Admin/export clients get a whole directory in one response. Rows are read with
+`iterator(chunk_size=...)` and encoded chunk by chunk into a streamed JSON array,
+so memory stays flat however many rows there are. `?fields=`/`?exclude=` work
+as on the paginated listings.
+"""
+class DirectoryExportView(APIView):
+    permission_classes = [IsAdminUser]
+    serializer_class = None
+    chunk_size = getattr(settings, "DIRECTORY_EXPORT_CHUNK_SIZE", 2000)
 
     def get(self, request, format=None):
-        teachers = TeacherProfile.objects.all()
-        serializer = TeacherCardSerializer(teachers, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
+        queryset = self.serializer_class.prune_queryset(self.get_queryset(), request)
+        rows = self.serializer_class.values_queryset(queryset, request).order_by("id")
+        content = iter_json_array(
+            rows.iterator(chunk_size=self.chunk_size),
+            chunk_size=self.chunk_size,
+            transform=lambda chunk: self.serializer_class.values_rows(chunk, request),
+        )
+        return StreamingHttpResponse(content, content_type="application/json")
 
-class AllTeacherImagesView(APIView):
-    permission_classes = [AllowAny]
+
+class TeachersExportView(DirectoryExportView):
+    serializer_class = TeacherCardSerializer
+
+    def get_queryset(self):
+        return TeacherProfile.objects.cards()
+
+
+class StudentsExportView(DirectoryExportView):
+    serializer_class = StudentCardSerializer
+
+    def get_queryset(self):
+        return StudentProfile.objects.select_related("user")
+
+
+class DirectoryCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
 
     def get(self, request, format=None):
-        profile_pictures = ProfilePicture.objects.all()
-        serializer = ProfilePictureSerializer(profile_pictures, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(get_directory_cache_stats(), status=status.HTTP_200_OK)
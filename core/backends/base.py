@@ -0,0 +1,78 @@
+import threading
+import time
+
+"""
+Connection Metrics
+
+The backends in core.backends wrap Django's sqlite3 and postgresql ones and
+record, per alias, how many connections a worker opens and how long it waits
+for them: a full connect and login without pooling, a checkout (possibly
+queued behind other threads) with the psycopg pool. With CONN_MAX_AGE or a
+pool, connects per request should stay well below one.
+
+Connections that fail a CONN_HEALTH_CHECKS ping and are reopened are counted
+too. The numbers are per process, like the connections and the pool.
+"""
+
+_lock = threading.Lock()
+_requests = 0
+_aliases = {}
+
+
+def _empty():
+    return {"connects": 0, "wait_total": 0.0, "wait_max": 0.0, "health_check_closes": 0}
+
+
+def record_request(**kwargs):
+    global _requests
+    with _lock:
+        _requests += 1
+
+
+def record_connect(alias, seconds):
+    with _lock:
+        stats = _aliases.setdefault(alias, _empty())
+        stats["connects"] += 1
+        stats["wait_total"] += seconds
+        stats["wait_max"] = max(stats["wait_max"], seconds)
+
+
+def record_health_check_close(alias):
+    with _lock:
+        _aliases.setdefault(alias, _empty())["health_check_closes"] += 1
+
+
+def reset_connection_stats():
+    global _requests
+    with _lock:
+        _requests = 0
+        _aliases.clear()
+
+
+def get_connection_stats():
+    with _lock:
+        requests = _requests
+        aliases = {alias: dict(stats) for alias, stats in _aliases.items()}
+    for stats in aliases.values():
+        connects = stats["connects"]
+        stats["wait_avg_ms"] = round(stats["wait_total"] * 1000 / connects, 3) if connects else 0.0
+        stats["wait_max_ms"] = round(stats.pop("wait_max") * 1000, 3)
+        stats["wait_total_ms"] = round(stats.pop("wait_total") * 1000, 3)
+        stats["connects_per_request"] = round(connects / requests, 4) if requests else 0.0
+    return {"requests": requests, "databases": aliases}
+
+
+class ConnectionMetricsMixin:
+    def get_new_connection(self, conn_params):
+        started = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        record_connect(self.alias, time.perf_counter() - started)
+        return connection
+
+    def close_if_health_check_failed(self):
+        if self.connection is not None and self.health_check_enabled and not self.health_check_done:
+            if not self.is_usable():
+                record_health_check_close(self.alias)
+                self.close()
+            self.health_check_done = True
+        super().close_if_health_check_failed()
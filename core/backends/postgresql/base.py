@@ -0,0 +1,6 @@
+from django.db.backends.postgresql import base
+from core.backends.base import ConnectionMetricsMixin
+
+
+class DatabaseWrapper(ConnectionMetricsMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,108 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.db import pragma_statements
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent readers and writers against a scratch SQLite file with SQLite's "
+        "default settings and with SQLITE_PRAGMAS, and reports the throughput of each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run each configuration.")
+        parser.add_argument("--rows", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        transaction_mode = settings.DATABASES["default"].get("OPTIONS", {}).get("transaction_mode") or "DEFERRED"
+        configurations = [
+            ("default", {}, "DEFERRED"),
+            ("tuned", getattr(settings, "SQLITE_PRAGMAS", {}), transaction_mode),
+        ]
+        for name, pragmas, mode in configurations:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bench.sqlite3")
+                self.seed(path, pragmas, options["rows"])
+                results = self.run(path, pragmas, mode, options)
+            self.stdout.write(
+                f"{name:8} reads {results['reads'] / results['elapsed']:10.0f}/s  "
+                f"writes {results['writes'] / results['elapsed']:8.0f}/s  "
+                f"locked {results['locked']}  ({mode.lower()} transactions)"
+            )
+
+    def seed(self, path, pragmas, rows):
+        connection = self.connect(path, pragmas)
+        connection.execute("BEGIN")
+        connection.execute("CREATE TABLE profile (id INTEGER PRIMARY KEY, bio TEXT, updated_at REAL)")
+        connection.executemany(
+            "INSERT INTO profile (id, bio, updated_at) VALUES (?, ?, ?)",
+            ((index, "x" * 200, time.time()) for index in range(rows)),
+        )
+        connection.execute("COMMIT")
+        connection.close()
+
+    def connect(self, path, pragmas):
+        # Python's default 5s lock timeout, as Django uses; busy_timeout in
+        # the pragmas overrides it.
+        connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        for statement in pragma_statements(pragmas):
+            connection.execute(statement)
+        return connection
+
+    def run(self, path, pragmas, transaction_mode, options):
+        rows = options["rows"]
+        deadline = time.perf_counter() + options["duration"]
+        counts = {"reads": 0, "writes": 0, "locked": 0}
+        lock = threading.Lock()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def read():
+            connection = self.connect(path, pragmas)
+            while time.perf_counter() < deadline:
+                try:
+                    connection.execute("SELECT bio FROM profile WHERE id = ?", (random.randrange(rows),)).fetchone()
+                except sqlite3.OperationalError:
+                    count("locked")
+                else:
+                    count("reads")
+            connection.close()
+
+        def write():
+            # Read-then-write in one transaction, like a Django view that
+            # loads a row and saves it inside atomic().
+            connection = self.connect(path, pragmas)
+            while time.perf_counter() < deadline:
+                row = random.randrange(rows)
+                try:
+                    connection.execute(f"BEGIN {transaction_mode}")
+                    connection.execute("SELECT bio FROM profile WHERE id = ?", (row,)).fetchone()
+                    connection.execute("UPDATE profile SET updated_at = ? WHERE id = ?", (time.time(), row))
+                    connection.execute("COMMIT")
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    count("locked")
+                else:
+                    count("writes")
+            connection.close()
+
+        threads = [threading.Thread(target=read) for _ in range(options["readers"])]
+        threads += [threading.Thread(target=write) for _ in range(options["writers"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts["elapsed"] = time.perf_counter() - started
+        return counts
@@ -0,0 +1,44 @@
+import time
+from django.conf import settings
+from .routers import get_replicas, pin_user, replicas_allowed, wrote
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ReadYourWritesMiddleware:
+    """
+    Lets safe requests read from the replicas, except for clients that wrote
+    within the last DATABASE_PIN_SECONDS, who are pinned to the primary so
+    they always see their own changes: by a cookie, and for authenticated
+    users also by user id (see core.routers.check_user_pin).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_replicas():
+            return self.get_response(request)
+
+        cookie = getattr(settings, "DATABASE_PIN_COOKIE", "db_pin")
+        allowed = replicas_allowed.set(request.method in SAFE_METHODS and not self.is_pinned(request, cookie))
+        written = wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if wrote.get() or request.method not in SAFE_METHODS:
+                seconds = getattr(settings, "DATABASE_PIN_SECONDS", 5)
+                response.set_cookie(cookie, str(time.time() + seconds), max_age=seconds, httponly=True, samesite="Lax")
+                # DRF copies the authenticated user onto the Django request.
+                user = getattr(request, "user", None)
+                if user is not None and user.is_authenticated:
+                    pin_user(user.pk)
+            return response
+        finally:
+            replicas_allowed.reset(allowed)
+            wrote.reset(written)
+
+    def is_pinned(self, request, cookie):
+        try:
+            return float(request.COOKIES.get(cookie, 0)) > time.time()
+        except ValueError:
+            return False
@@ -0,0 +1,77 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+
+"""
+Primary/Replica Routing
+
+Writes always go to "default". Reads go to one of DATABASE_REPLICAS, but only
+inside a request that ReadYourWritesMiddleware has marked as replica safe:
+a GET/HEAD/OPTIONS from a client that has not written recently. Everything
+else (management commands, workers, writes and the reads around them) stays
+on the primary, so select_for_update() and read-then-write code never see a
+lagging copy.
+
+A write during a replica safe request pins the rest of that request to the
+primary, and the middleware then pins the client for DATABASE_PIN_SECONDS:
+by cookie, and for authenticated users by a key in DATABASE_PIN_CACHE_ALIAS
+that the authentication classes check, since token clients on other origins
+never send the cookie back.
+"""
+
+replicas_allowed = ContextVar("replicas_allowed", default=False)
+wrote = ContextVar("wrote", default=False)
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def get_pin_cache():
+    return caches[getattr(settings, "DATABASE_PIN_CACHE_ALIAS", "default")]
+
+
+def user_pin_key(user_id):
+    return f"db_pin:user:{user_id}"
+
+
+def pin_user(user_id):
+    get_pin_cache().set(user_pin_key(user_id), True, getattr(settings, "DATABASE_PIN_SECONDS", 5))
+
+
+def check_user_pin(user_id):
+    """Sends the rest of the request to the primary if the user wrote recently."""
+    if replicas_allowed.get() and get_pin_cache().get(user_pin_key(user_id)):
+        replicas_allowed.set(False)
+
+
+@contextmanager
+def use_primary():
+    """Sends the reads in the block to the primary even in a replica safe request."""
+    token = replicas_allowed.set(False)
+    try:
+        yield
+    finally:
+        replicas_allowed.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if replicas and replicas_allowed.get():
+            return random.choice(replicas)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        replicas_allowed.set(False)
+        wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
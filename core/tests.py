@@ -1,3 +1,209 @@
-from django.test import TestCase
+import time
+from io import StringIO
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from auth_account.cache import user_cache
+from auth_account.models import ProfilePicture
+from auth_account.views import get_tokens_for_user
+from .backends.base import get_connection_stats, reset_connection_stats
+from .db import pragma_statements
+from .middleware import ReadYourWritesMiddleware
+from .routers import PrimaryReplicaRouter
 
-# Create your tests here.
+
+class SQLitePragmaTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        self.assertEqual(self.pragma("synchronous"), 1)
+        self.assertEqual(self.pragma("cache_size"), -20000)
+
+
+class PragmaStatementTests(SimpleTestCase):
+    def test_busy_timeout_is_applied_first(self):
+        statements = list(pragma_statements({"journal_mode": "WAL", "busy_timeout": 5000}))
+        self.assertEqual(statements, ["PRAGMA busy_timeout = 5000", "PRAGMA journal_mode = WAL"])
+
+    def test_rejects_anything_but_plain_names_and_values(self):
+        with self.assertRaises(ValueError):
+            list(pragma_statements({"journal_mode": "WAL; DROP TABLE x"}))
+        with self.assertRaises(ValueError):
+            list(pragma_statements({"cache size": 1}))
+
+    @override_settings(SQLITE_PRAGMAS={"journal_mode": "WAL", "busy_timeout": 1000, "synchronous": "NORMAL"})
+    def test_benchmark_reports_both_configurations(self):
+        out = StringIO()
+        call_command("bench_sqlite", "--duration", "0.2", "--rows", "100", "--readers", "2", "--writers", "2", stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ["default", "tuned"])
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReadReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = PrimaryReplicaRouter()
+
+    def handle(self, request, write=False):
+        seen = {}
+
+        def view(request):
+            seen["before"] = self.router.db_for_read(ProfilePicture)
+            if write:
+                self.router.db_for_write(ProfilePicture)
+                seen["after"] = self.router.db_for_read(ProfilePicture)
+            return HttpResponse()
+
+        response = ReadYourWritesMiddleware(view)(request)
+        return seen, response
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(self.router.db_for_read(ProfilePicture), "default")
+        self.assertEqual(self.router.db_for_write(ProfilePicture), "default")
+        self.assertFalse(self.router.allow_migrate("replica", "auth_account"))
+
+    def test_safe_requests_read_from_a_replica(self):
+        seen, response = self.handle(self.factory.get("/auth/teachers/"))
+        self.assertEqual(seen["before"], "replica")
+        self.assertNotIn("db_pin", response.cookies)
+        self.assertEqual(self.router.db_for_read(ProfilePicture), "default")
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        seen, response = self.handle(self.factory.post("/auth/profile/picture/"))
+        self.assertEqual(seen["before"], "default")
+        pin = response.cookies["db_pin"]
+        self.assertEqual(pin["max-age"], 5)
+
+        request = self.factory.get("/auth/me/")
+        request.COOKIES["db_pin"] = pin.value
+        self.assertEqual(self.handle(request)[0]["before"], "default")
+
+        request.COOKIES["db_pin"] = str(time.time() - 1)
+        self.assertEqual(self.handle(request)[0]["before"], "replica")
+
+    def test_write_during_a_safe_request_pins_the_rest_of_it(self):
+        seen, response = self.handle(self.factory.get("/auth/me/"), write=True)
+        self.assertEqual((seen["before"], seen["after"]), ("replica", "default"))
+        self.assertIn("db_pin", response.cookies)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_nothing_changes(self):
+        seen, response = self.handle(self.factory.post("/auth/profile/picture/"))
+        self.assertEqual(seen["before"], "default")
+        self.assertNotIn("db_pin", response.cookies)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReadYourWritesStackTests(TestCase):
+    """
+    Requests through the whole stack. The test database has no replica alias,
+    so the router's choices are recorded and every query still runs on
+    "default".
+    """
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.routes = []
+        db_for_read = PrimaryReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.routes.append((model._meta.label_lower, db_for_read(router, model, **hints)))
+            return "default"
+
+        patcher = mock.patch.object(PrimaryReplicaRouter, "db_for_read", record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client_for(self, email):
+        user = get_user_model().objects.create_user(email=email, username=email)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(user)['access']}")
+        return client
+
+    def test_safe_requests_load_the_token_user_from_the_primary(self):
+        response = self.client_for("reader@example.com").get(reverse("me"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.routes[0], ("auth_account.customuser", "default"))
+        self.assertIn(("auth_account.customuser", "replica"), self.routes[1:])
+
+    def test_token_clients_read_their_writes_without_the_cookie(self):
+        writer = self.client_for("writer@example.com")
+        other = self.client_for("other@example.com")
+        self.assertEqual(writer.post(reverse("profile"), {"first_name": "Changed"}).status_code, status.HTTP_200_OK)
+        writer.cookies.clear()
+
+        self.routes.clear()
+        response = writer.get(reverse("me"))
+        self.assertEqual(response.data["first_name"], "Changed")
+        self.assertTrue(self.routes)
+        self.assertEqual({alias for _, alias in self.routes}, {"default"})
+
+        self.routes.clear()
+        other.get(reverse("me"))
+        self.assertIn("replica", {alias for _, alias in self.routes})
+
+
+class ConnectionMetricsTests(SimpleTestCase):
+    # Opens its own connections next to the test database's.
+    databases = {"default"}
+
+    def setUp(self):
+        reset_connection_stats()
+        self.wrapper = connections.create_connection("default")
+        self.addCleanup(self.wrapper.close)
+
+    def test_new_connections_are_timed(self):
+        self.wrapper.ensure_connection()
+        self.wrapper.ensure_connection()
+        stats = get_connection_stats()["databases"]["default"]
+        self.assertEqual(stats["connects"], 1)
+        self.assertGreater(stats["wait_total_ms"], 0)
+        self.assertEqual(stats["wait_max_ms"], stats["wait_total_ms"])
+
+    def test_failed_health_checks_are_counted(self):
+        self.wrapper.ensure_connection()
+        self.wrapper.health_check_enabled = True
+        self.wrapper.health_check_done = False
+        self.wrapper.close_if_health_check_failed()
+        self.assertEqual(get_connection_stats()["databases"]["default"]["health_check_closes"], 0)
+
+        self.wrapper.health_check_done = False
+        with mock.patch.object(self.wrapper, "is_usable", return_value=False):
+            self.wrapper.close_if_health_check_failed()
+        self.assertEqual(get_connection_stats()["databases"]["default"]["health_check_closes"], 1)
+
+    def test_connects_per_request(self):
+        self.wrapper.ensure_connection()
+        for _ in range(4):
+            self.client.get("/core/db/stats/")
+        stats = get_connection_stats()
+        self.assertEqual(stats["requests"], 4)
+        self.assertEqual(stats["databases"]["default"]["connects_per_request"], 0.25)
+
+
+class ConnectionStatsViewTests(TestCase):
+    def test_stats_are_admin_only(self):
+        client = APIClient()
+        self.assertEqual(client.get(reverse("db_connection_stats")).status_code, status.HTTP_401_UNAUTHORIZED)
+        admin = get_user_model().objects.create_superuser(email="admin@example.com", username="admin@example.com")
+        client.force_authenticate(admin)
+        response = client.get(reverse("db_connection_stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.data["requests"], 1)
+        self.assertIn("conn_max_age", response.data["databases"]["default"])
+        self.assertIn("pool", response.data["databases"]["default"])
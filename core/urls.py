@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import ConnectionStatsView
+
+urlpatterns = [
+    path("db/stats/", ConnectionStatsView.as_view(), name="db_connection_stats"),
+]
@@ -1,3 +1,22 @@
-from django.shortcuts import render
+from django.conf import settings
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .backends.base import get_connection_stats
 
-# Create your views here.
+
+class ConnectionStatsView(APIView):
+    """Connection counts and wait times of the worker that answers the request."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        stats = get_connection_stats()
+        for alias, database in settings.DATABASES.items():
+            stats["databases"].setdefault(alias, {}).update({
+                "conn_max_age": database.get("CONN_MAX_AGE", 0),
+                "conn_health_checks": database.get("CONN_HEALTH_CHECKS", False),
+                "pool": database.get("OPTIONS", {}).get("pool"),
+            })
+        return Response(stats, status=status.HTTP_200_OK)
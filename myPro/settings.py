@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import django
 from datetime import timedelta
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.ReadYourWritesMiddleware",
 ]
 INTERNAL_IPS = [
     # ...
@@ -69,13 +71,32 @@ CORS_ALLOWED_ORIGINS = [
 ]
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "auth_account.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly"
     ],
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "islam-default",
+    },
+}
+
+# Page sizes for the cursor paginated public directory endpoints.
+DIRECTORY_PAGE_SIZE = 50
+DIRECTORY_MAX_PAGE_SIZE = 200
+# Rows fetched and encoded per chunk by the streaming directory exports.
+DIRECTORY_EXPORT_CHUNK_SIZE = 2000
+# Cache used for the public directory responses. Use a file based or shared
+# cache here when running more than one worker process.
+DIRECTORY_CACHE_ALIAS = "default"
+DIRECTORY_CACHE_TIMEOUT = 300
+# Expired pages are still served for this long while one request rebuilds them.
+DIRECTORY_CACHE_STALE_TIMEOUT = 60
+
 AUTH_USER_MODEL = "auth_account.CustomUser"
 
 ROOT_URLCONF = "myPro.urls"
@@ -100,15 +121,123 @@ WSGI_APPLICATION = "myPro.wsgi.application"
 
 
 
+# Persistent connections: each worker keeps its connection for DB_CONN_MAX_AGE
+# seconds instead of reconnecting on every request ("0" closes it after each
+# request, "none" never), and pings it before reuse when DB_CONN_HEALTH_CHECKS
+# is on so a connection dropped by the server is reopened instead of failing
+# the request. Keep DB_CONN_MAX_AGE at 0 under ASGI and use the pool instead.
+DB_CONN_MAX_AGE = os.environ.get("DB_CONN_MAX_AGE", "60")
+DB_CONN_MAX_AGE = None if DB_CONN_MAX_AGE.lower() == "none" else int(DB_CONN_MAX_AGE)
+DB_CONN_HEALTH_CHECKS = os.environ.get("DB_CONN_HEALTH_CHECKS", "1") == "1"
+
+# The core.backends engines wrap Django's and record connect and pool wait
+# times, served at /core/db/stats/.
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "core.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+        "OPTIONS": {},
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
     }
 }
+# Take the write lock when a transaction starts instead of on its first write,
+# so concurrent writers wait on busy_timeout rather than failing a lock upgrade.
+# Django 5.1+ only.
+if django.VERSION >= (5, 1):
+    DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+# Test on a file rather than SQLite's shared-cache in-memory database, which
+# fails concurrent writers outright instead of letting them wait on
+# busy_timeout; the concurrent upload tests need real locking.
+DATABASES["default"]["TEST"] = {"NAME": os.path.join(BASE_DIR, "test_db.sqlite3")}
+
+# Postgres: set POSTGRES_DB (and POSTGRES_USER/PASSWORD/HOST/PORT) and install
+# psycopg. DB_POOL_MAX_SIZE > 0 gives every worker process a psycopg pool of
+# that many connections (Django 5.1+, `pip install "psycopg[pool]"`); requests
+# then check a connection out and back in rather than holding their own, and
+# wait up to DB_POOL_TIMEOUT seconds when all of them are busy. Size it so
+# workers * DB_POOL_MAX_SIZE stays under the server's max_connections.
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 0))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+if os.environ.get("POSTGRES_DB"):
+    DATABASES["default"] = {
+        "ENGINE": "core.backends.postgresql",
+        "NAME": os.environ["POSTGRES_DB"],
+        "USER": os.environ.get("POSTGRES_USER", ""),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+        "OPTIONS": {},
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
+    }
+    if DB_POOL_MAX_SIZE and django.VERSION >= (5, 1):
+        # The pool keeps the connections open; Django refuses a pool combined
+        # with persistent connections.
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT,
+        }
+
+# Read replicas: aliases in DATABASES that serve reads of safe requests (see
+# core.routers). Setting DATABASE_REPLICA_NAME adds a "replica" alias on that
+# SQLite file, e.g. a copy refreshed with `sqlite3 db.sqlite3 ".backup replica.sqlite3"`,
+# or point it at a Postgres container by editing the alias below. Leave it unset
+# for the test suite: TestCase data lives in an uncommitted transaction on
+# "default" that a replica connection cannot see.
+DATABASE_REPLICAS = []
+if os.environ.get("DATABASE_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        "ENGINE": "core.backends.sqlite3",
+        "NAME": os.environ["DATABASE_REPLICA_NAME"],
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": DB_CONN_HEALTH_CHECKS,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS = ["replica"]
+DATABASE_ROUTERS = ["core.routers.PrimaryReplicaRouter"]
+# After a write the client reads from the primary for this many seconds,
+# tracked with this cookie and, for authenticated users, by user id in this
+# cache (use a shared one when running more than one worker process); keep it
+# above the replicas' usual lag.
+DATABASE_PIN_SECONDS = 5
+DATABASE_PIN_COOKIE = "db_pin"
+DATABASE_PIN_CACHE_ALIAS = "default"
+
+# Applied to every new SQLite connection by core.db.apply_sqlite_pragmas.
+# `python manage.py bench_sqlite` compares them against SQLite's defaults.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -20000,
+    "mmap_size": 128 * 1024 * 1024,
+}
 
 
 
+# The pooled hasher writes the same pbkdf2_sha256 hashes as Django's default
+# one, so existing passwords keep verifying. Django's PBKDF2PasswordHasher must
+# not be listed as well: hashers are looked up by algorithm and the last one
+# with "pbkdf2_sha256" would take over verification.
+PASSWORD_HASHERS = [
+    "auth_account.hashers.PooledPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+# Worker processes for password hashing and the number of hashes allowed to
+# queue for them before callers wait. Off by default: hashlib already releases
+# the GIL during PBKDF2 and the request thread waits for the result either way,
+# so the pool mainly caps how many derivations compete for the CPU. It is per
+# server process, so keep it small (workers x this many processes in total).
+PASSWORD_HASHING_WORKERS = int(os.environ.get("PASSWORD_HASHING_WORKERS", 0))
+PASSWORD_HASHING_MAX_PENDING = 0  # 0: four per worker
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -143,6 +272,31 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# How MediaView hands files to the front server: None streams them from Django
+# (sendfile through the WSGI file wrapper), "x-accel-redirect" for nginx with
+# an internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT,
+# or "x-sendfile" for Apache/lighttpd.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+# Cache lifetime of media that is not content addressed.
+MEDIA_CACHE_MAX_AGE = 3600
+
+# Square variants rendered for every profile picture upload.
+PROFILE_PICTURE_VARIANT_SIZES = [64, 128, 512]
+PROFILE_PICTURE_VARIANT_FORMATS = ["webp", "jpeg"]
+# Release a picture's files (original and variants) when it is replaced or deleted.
+# Content addressed files are only unlinked by `collect_orphaned_media`, which
+# also removes anything left behind when this is off.
+PROFILE_PICTURE_DELETE_FILES = True
+# Resumable picture uploads. Partial files live under MEDIA_ROOT/CHUNKED_UPLOAD_DIR
+# (never served) until finalized; `collect_orphaned_media` drops uploads idle
+# for longer than CHUNKED_UPLOAD_EXPIRY seconds.
+CHUNKED_UPLOAD_DIR = "uploads/chunked"
+CHUNKED_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 5 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+# Unexpired uploads a user may have open at once.
+CHUNKED_UPLOAD_MAX_OPEN = 3
 
 
 # _____________________EMAIL SENDING SETTINGS Starts______________________
@@ -157,9 +311,15 @@ EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_PASSWORD_ISS")
 # DEFAULT_FROM_EMAIL = os.environ.get("EMAIL_FROM")
 EMAIL_USE_TLS = True
 
-EMAIL_TIMEOUT = None
+EMAIL_TIMEOUT = 10
+# Password reset emails are queued in the OutboundEmail table and delivered by
+# `python manage.py send_queued_emails --loop`.
 # _____________________EMAIL SENDING SETTINGS Ends______________________
 # _____________________JWT SETTINGS Starts______________________
+# Per-process cache of users resolved from JWTs (entries, seconds).
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TTL = 60
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),